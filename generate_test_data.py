@@ -1,4 +1,4 @@
-from masserstein import Spectrum, peptides, estimate_proportions
+from masserstein import Spectrum, peptides, estimate_proportions, pairwise_wasserstein
 from copy import deepcopy
 import scipy as sp
 import numpy as np
@@ -21,16 +21,15 @@ haemoglobinB_formula = peptides.get_protein_formula(haemoglobinB_fasta)
 myoglobin_formula = peptides.get_protein_formula(myoglobin_fasta)
 
 # Generatin individual spectra
-hA19 = Spectrum(haemoglobinA_formula, charge=19, adduct='H', label='hA 19+')
-hA20 = Spectrum(haemoglobinA_formula, charge=20, adduct='H', label='hA 20+')
-hA21 = Spectrum(haemoglobinA_formula, charge=21, adduct='H', label='hA 21+')
-hB20 = Spectrum(haemoglobinB_formula, charge=20, adduct='H', label='hB 20+')
-hB21 = Spectrum(haemoglobinB_formula, charge=21, adduct='H', label='hB 21+')
-hB22 = Spectrum(haemoglobinB_formula, charge=22, adduct='H', label='hB 22+')
-m21  = Spectrum(myoglobin_formula, charge=21, adduct='H', label='myo 21+')
-m22  = Spectrum(myoglobin_formula, charge=22, adduct='H', label='myo 22+')
-m23  = Spectrum(myoglobin_formula, charge=23, adduct='H', label='myo 23+')
-m24  = Spectrum(myoglobin_formula, charge=24, adduct='H', label='myo 24+')
+hA19, hA20, hA21 = Spectrum.new_charge_states(
+    haemoglobinA_formula, [19, 20, 21], adduct='H',
+    labels=['hA 19+', 'hA 20+', 'hA 21+'])
+hB20, hB21, hB22 = Spectrum.new_charge_states(
+    haemoglobinB_formula, [20, 21, 22], adduct='H',
+    labels=['hB 20+', 'hB 21+', 'hB 22+'])
+m21, m22, m23, m24 = Spectrum.new_charge_states(
+    myoglobin_formula, [21, 22, 23, 24], adduct='H',
+    labels=['myo 21+', 'myo 22+', 'myo 23+', 'myo 24+'])
 spectra = [hA19, hA20, hA21, hB20, hB21, hB22, m21, m22, m23, m24]
 k = len(spectra)
 
@@ -42,19 +41,14 @@ for s in spectra:
 #Spectrum.plot_all(spectra)
 
 # Wasserstein distance matrix:
-wM = np.zeros((k,k))
-for i in range(k):
-    for j in range(k):
-        wM[i,j] = spectra[i].WSDistance(spectra[j])
+wM = pairwise_wasserstein(spectra)
 
 # Setting example proportions
 proportions = [1, 2, 1.2, 0.5, 0.9, 0.6, 0.2, 0.3, 0.4, 0.]
 proportions = [p/sum(proportions) for p in proportions]
 
 # Generating a convolved spectrum
-convolved = Spectrum('', empty=True, label='Convolved')
-for s, p in zip(spectra, proportions):
-    convolved += s*p
+convolved = Spectrum.linear_combination(spectra, proportions, label='Convolved')
 
 ##convolved.plot()
 
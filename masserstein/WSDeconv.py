@@ -1,10 +1,12 @@
 #! /usr/bin/python3
 from masserstein import Spectrum
 from masserstein import estimate_proportions
+from masserstein import read_peak_list
+from masserstein import SpectrumCache, set_spectrum_cache
+from masserstein import expand_expression
 from getopt import getopt
 import numpy as np
 import sys
-import re
 
 doc = """NAME:
     WSDeconv
@@ -43,6 +45,10 @@ DESCRIPTION:
     of a singly-charged ion. Therefore, writing NH3 + H is equivalent to NH4,
     and COOH - H is equivalent to COO. However, simply writing 'NH3 ' will inform the program
     that this is a singly-charged modecule!
+    Elemental formulas may be also in the form of 'molecular regular expressions',
+    e.g. CH3(CH2)[2,5-7]NH2 + H[0-1]Na[0-1]. This will expand the CH2 part either 2 or from 5 to 7
+    times and, for each chain length, will add a hydrogen, a sodium, or both atoms.
+    As before, the first part is assumed represent a neutral state of the molecule.
 
 OPTIONS:
     -h
@@ -74,6 +80,12 @@ OPTIONS:
         does not match any experimental peak within this distance, this envelope is
         filtered out during preprocessing and it's proportion is assumed to be zero.
         Set to -1 to disable filtering.
+    -j: int, default: 1
+        The number of processes used to simulate theoretical isotopic envelopes.
+        Set to -1 to use all available processors.
+    -k: directory, default: none
+        Store the theoretical isotopic envelopes in this directory,
+        so that they are computed only once and reused in subsequent runs.
     -s
         Suppress writing additional output files - write out only proportions.
     -v
@@ -83,13 +95,6 @@ CONTACT:
     If you encounter any problems during use of this application, please email me at m_ciach@student.uw.edu.pl.
 """
 
-to_add_when_implemented = """
-    Elemental formulas may be also in the form of 'molecular regular expressions',
-    e.g. CH3(CH2)[2,5-7]NH2 + H[0-1]Na[0-1]. This will expand the CH2 part either 2 or from 5 to 7
-    times and, for each chain length, will add a hydrogen, a sodium, or both atoms.
-    As before, the first part is assumed represent a neutral state of the molecule.
-    """
-
 mass_warning = """
 WARNING: Detected a large-distance mass transport between masses %.2f and %.2f.
 Please report this to the authors.
@@ -102,8 +107,9 @@ def main():
     MDC = 1e-12 # minimum detectable current
     only_proportions = False
     verbose = False
+    n_jobs = 1
 
-    opts, args = getopt(sys.argv[1:], 'hp:t:c:d:sv')
+    opts, args = getopt(sys.argv[1:], 'hp:t:c:d:j:k:sv')
 
     if not args:
         print(doc)
@@ -125,6 +131,11 @@ def main():
         if opt == '-d':
             MMD = float(arg)
             assert MMD == -1 or MMD >= 0, 'Improper Maximum Mode Distance: %f' % MMD
+        if opt == '-j':
+            n_jobs = int(arg)
+            assert n_jobs == -1 or n_jobs >= 1, 'Improper number of processes: %i' % n_jobs
+        if opt == '-k':
+            set_spectrum_cache(SpectrumCache(path=arg))
         if opt == '-v':
             verbose = True
         if opt == '-s':
@@ -156,30 +167,6 @@ def main():
     print(LOG)
 
     # Parse molecule list & construct list of theoretical spectra:
-    def parse_mol_formula(mstr):
-        """
-        Expands the molecular regular expression mstr to a list of formulas.
-        Each element of the returned list is a tuple with a full formula, the adduct formula, and charge.
-        """
-        formulas = []
-        charge_sign = re.findall('[+-]', mstr)
-        if len(charge_sign) == 1:
-            charge_sign = charge_sign[0]
-            neutral, adduct = mstr.split(charge_sign)
-            neutral = neutral.strip()
-            adduct = adduct.strip()
-            adduct_parsed = re.findall('([A-Z][a-z]*)([0-9]*)', adduct)
-            adduct, charge = adduct_parsed[0]
-            charge = int(charge)
-    ##        for e, n in adduct_parsed:
-    ##            charge += int(n) if n else 1
-        elif len(charge_sign) == 0:
-            neutral, adduct = mstr.strip(), None
-            charge = 1
-        else:
-            raise ValueError('Improper charge signs:' + str(charge_sign))
-        return (neutral, adduct, charge)
-
     try:
         molecules = open(molecules).readlines()
     except IOError:
@@ -188,23 +175,19 @@ def main():
         print('Read molecules:')
         print(molecules)
     molecules = [m.strip() for m in molecules if m and m[0] != '#']
-    parsed_molecules = [parse_mol_formula(m) for m in molecules]
+    ions = [ion for m in molecules for ion in expand_expression(m)]
+    molecules = [label for label, _, _ in ions]
     if verbose:
-        print('Molecule\tAdduct\tCharge')
-        for n,a,c in parsed_molecules:
-            print(n,a,c,sep='\t')
-    thr_spctrs = [Spectrum(f, threshold = 1-prob, intensity=1.0 , charge=c, adduct=a) for f, a, c in parsed_molecules]
-    for s in thr_spctrs:
-        s.normalize()
-
-    # Parsing spectrum:
-    peaklist = open(spectrum).readlines()
-    peaklist = [list(map(float, l.strip().split())) for l in peaklist if l and l[0] != '#']
+        print('Ion\tFormula\tCharge')
+        for n,f,c in ions:
+            print(n,f,c,sep='\t')
+    thr_spctrs = Spectrum.batch_from_formulas([f for _, f, _ in ions],
+                                              [c for _, _, c in ions],
+                                              threshold=1-prob, labels=molecules,
+                                              normalize=True, n_jobs=n_jobs)
 
-    # Spectrum initialization:
-    spectrum = Spectrum("", empty=True)
-    spectrum.set_confs(peaklist)
-    del peaklist
+    # Parsing spectrum & spectrum initialization:
+    spectrum = Spectrum.new_from_arrays(*read_peak_list(spectrum))
 
     # Normalize and obtain mz range:
     spectrum.normalize()
@@ -213,7 +196,8 @@ def main():
         penalty = mass_range + 10.
 
     # Proportion estimation:
-    result = estimate_proportions(spectrum, thr_spctrs, penalty, MDC, MMD, verbose)
+    result = estimate_proportions(spectrum, thr_spctrs, MTD=penalty, MDC=MDC,
+                                  MMD=MMD, verbose=verbose)
     total_signal = sum(result['proportions'])
     result['proportions'] = [p/total_signal for p in result['proportions']]
 
@@ -222,10 +206,8 @@ def main():
         print('Amount of noise detected: %f' % sum(result['noise']))
         LOG += 'Amount of noise detected: %f' % sum(result['noise']) + '\n'
         # Obtain fitted theoretical spectrum:
-        fitted = Spectrum("", empty=True)
         # normalized_proportions = [w/sum(result['proportions']) for w in result['proportions']]
-        for s, w in zip(thr_spctrs, result['proportions']):
-            fitted += s*w
+        fitted = Spectrum.linear_combination(thr_spctrs, result['proportions'])
         fitted.normalize()
 
         # Obtain denoised spectrum:
@@ -234,10 +216,10 @@ def main():
         denoised.normalize()
 
         # Obtain transport plan:
-        mvs = [mv for mv in fitted.WSDistanceMoves(denoised) if mv[2] > 1e-06]
-        max_mv = max(mvs, key=lambda x: abs(x[1]-x[0]))
-    ##    if abs(max_mv[1]-max_mv[0]) > penalty:
-    ##        print((mass_warning % (max_mv[0], max_mv[1])))
+        mvs = fitted.WSDistanceMovesArrays(denoised, min_flow=1e-06)
+        max_mv = np.argmax(np.abs(mvs[1] - mvs[0]))
+    ##    if abs(mvs[1][max_mv]-mvs[0][max_mv]) > penalty:
+    ##        print((mass_warning % (mvs[0][max_mv], mvs[1][max_mv])))
         wsdist = denoised.WSDistance(fitted)
 
         print()
@@ -266,8 +248,8 @@ def main():
                     h.write(str(m) + '\t' + str(i) + '\n')
                 print('Fitted theoretical spectrum written to', output + '_fitted.txt')
             with open(output+'_transport.txt', 'w') as h:
-                for em, tm, i in mvs:
-                    h.write(str(em) + '\t' + str(tm) + '\t' + str(i) + '\n')
+                h.writelines('%r\t%r\t%r\n' % mv for mv in
+                             zip(*(a.tolist() for a in mvs)))
                 print('Optimal transport plan written to', output+'_transport.txt')
             with open(output+'_log.txt', 'w') as h:
                 h.write(LOG)
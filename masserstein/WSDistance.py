@@ -1,5 +1,6 @@
 #! /usr/bin/python3
 from masserstein import Spectrum
+from masserstein import read_peak_list
 from getopt import getopt
 from functools import reduce
 import numpy as np
@@ -15,6 +16,7 @@ USAGE:
 EXAMPLES:
     python WSDistance.py examples/ethanol.txt examples/acetic_acid.txt
     python WSDistance.py -t 1. -s examples/ethanol.txt examples/propane.txt
+    python WSDistance.py -p 0.5 examples/ethanol.txt examples/propane.txt
 
 DESCRIPTION:
     Computes the Wasserstein distance between two spectra.
@@ -35,6 +37,14 @@ RETURNS:
 OPTIONS:
     -s
         Print the optimal mass transport scheme.
+        The scheme is computed without the denoising penalty.
+    -p: float
+        The denoising penalty, interpretable as a maximum feasible distance of ion transport.
+        Intensity that would need to be transported further than this value
+        is removed from both spectra as noise, at the cost of half the penalty per unit
+        of intensity removed from each spectrum (i.e. the penalty per unit removed from both).
+        The penalized distance and the intensity removed from each spectrum are printed.
+        By default, no intensity is removed this way.
     -t: float
         The total intensity that is to remain in a spectrum after denoising.
         Default: 0.99, which means that peaks corresponding to at most 0.01 of the intensity
@@ -53,7 +63,9 @@ def main():
     norm = True
     print_transport = False
 
-    opts, args = getopt(sys.argv[1:], 'hst:')
+    penalty = None
+
+    opts, args = getopt(sys.argv[1:], 'hst:p:')
     if not args:
         print(doc)
         quit()
@@ -68,58 +80,62 @@ def main():
             quit()
         if opt == '-s':
             print_transport = True
+        if opt == '-p':
+            penalty = float(arg)
+            if not penalty > 0:
+                raise ValueError("Improper penalty value: %f" % penalty)
 
     sp1, sp2 = args
 
     print("Spectrum 1:", sp1)
     print("Spectrum 2:", sp2)
     print("Intensity cutoff:", thr)
+    if penalty is not None:
+        print("Denoising penalty:", penalty)
 
-    sp1 = open(sp1).readlines()
-    sp2 = open(sp2).readlines()
-
-    sp1 = [l.strip() for l in sp1]
-    sp2 = [l.strip() for l in sp2]
-
-    sp1 = [list(map(float, l.split())) for l in sp1 if l and l[0] != '#']
-    sp2 = [list(map(float, l.split())) for l in sp2 if l and l[0] != '#']
+    mz1, int1 = read_peak_list(sp1)
+    mz2, int2 = read_peak_list(sp2)
 
     if norm:
-        sum1 = sum(l[1] for l in sp1)
-        sp1 = [(l[0], l[1]/sum1) for l in sp1]
-        sum2 = sum(l[1] for l in sp2)
-        sp2 = [(l[0], l[1]/sum2) for l in sp2]
+        int1 = int1/int1.sum()
+        int2 = int2/int2.sum()
 
     if thr < 1:
-        order1 = sorted([x for x in enumerate((l[1] for l in sp1))], key=lambda y: y[1])  # ordering of intensities
-        cmsm1 = np.cumsum([x[1] for x in order1])  # cumsum of ordered intensities
-        to_remove1 = set([o[0] for o, c in zip(order1, cmsm1) if c < 1-thr])  # indices of peaks below threshold
-        sp1 = [l for i, l in enumerate(sp1) if i not in to_remove1]  # denoised spectrum
-
-        order2 = sorted([x for x in enumerate((l[1] for l in sp2))], key=lambda y: y[1])
-        cmsm2 = np.cumsum(order2)
-        to_remove2 = set([o[0] for o, c in zip(order2, cmsm2) if c < 1-thr])
-        sp2 = [l for i, l in enumerate(sp2) if i not in to_remove2]
-
-    Spectrum1 = Spectrum("", empty=True)
-    Spectrum1.set_confs(sp1)
+        order1 = np.argsort(int1, kind='stable')  # ordering of intensities
+        cmsm1 = np.cumsum(int1[order1])  # cumsum of ordered intensities
+        keep1 = np.ones(len(int1), dtype=bool)
+        keep1[order1[cmsm1 < 1-thr]] = False  # peaks below threshold
+        mz1, int1 = mz1[keep1], int1[keep1]  # denoised spectrum
+
+        order2 = np.argsort(int2, kind='stable')
+        cmsm2 = np.cumsum(int2[order2])
+        keep2 = np.ones(len(int2), dtype=bool)
+        keep2[order2[cmsm2 < 1-thr]] = False
+        mz2, int2 = mz2[keep2], int2[keep2]
+
+    Spectrum1 = Spectrum.new_from_arrays(mz1, int1)
     Spectrum1.normalize()
-    Spectrum2 = Spectrum("", empty=True)
-    Spectrum2.set_confs(sp2)
+    Spectrum2 = Spectrum.new_from_arrays(mz2, int2)
     Spectrum2.normalize()
 
-    W = Spectrum1.WSDistance(Spectrum2)
-
-    print()
-    print("Wasserstein distance:")
-    print(W)
+    if penalty is not None:
+        W, removed = Spectrum1.WSDistance(Spectrum2, penalty=penalty)
+        print()
+        print("Wasserstein distance with denoising penalty:")
+        print(W)
+        print("Intensity removed from each spectrum as noise:")
+        print(removed)
+    else:
+        W = Spectrum1.WSDistance(Spectrum2)
+        print()
+        print("Wasserstein distance:")
+        print(W)
 
     if print_transport:
-        mvs = list(Spectrum1.WSDistanceMoves(Spectrum2))
+        mvs = Spectrum1.WSDistanceMovesArrays(Spectrum2, min_flow=1e-6)
         print("Optimal transport scheme:")
-        for m in mvs:
-            if m[2] > 1e-6:
-                print('\t'.join(map(str, m)))
+        for m in zip(*(a.tolist() for a in mvs)):
+            print('\t'.join(map(str, m)))
 
 if __name__ == "__main__":
     main()
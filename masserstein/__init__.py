@@ -1,2 +1,7 @@
 from .spectrum import *
 from .deconv_simplex import *
+from .comparison import *
+from .readers import *
+from .cache import *
+from .formulas import *
+from .averagine import *
@@ -0,0 +1,100 @@
+import math
+import numpy as np
+from IsoSpecPy.PeriodicTbl import symbol_to_probs, symbol_to_massNo, \
+    symbol_to_avg_mass, symbol_to_monoisotopic_mass
+from .cache import _composition
+
+
+# The average amino acid of Senko et al. (1995)
+averagine = {'C': 4.9384, 'H': 7.7583, 'N': 1.3577, 'O': 1.4773, 'S': 0.0417}
+averagine_mass = sum(n*symbol_to_avg_mass[e] for e, n in averagine.items())
+# The average distance between consecutive isotopic peaks of peptides
+isotope_spacing = 1.00235
+# Isotopic patterns are tabulated for masses spaced by this many daltons
+_TABLE_STEP = 100.
+# Tabulated patterns, indexed by the mass divided by _TABLE_STEP
+_table = {}
+
+
+def _extra_neutrons(element):
+    mass_numbers = np.array(symbol_to_massNo[element], dtype=int)
+    return mass_numbers - mass_numbers.min()
+
+
+def _pattern(units):
+    """
+    Computes the aggregated isotopic pattern (probabilities of
+    consecutive numbers of additional neutrons) of a given number
+    of averagine units, using the FFT.
+    """
+    mean = 0.
+    variance = 0.
+    for e, n in averagine.items():
+        extra = _extra_neutrons(e)
+        probs = np.array(symbol_to_probs[e])
+        m = probs.dot(extra)
+        mean += n*units*m
+        variance += n*units*(probs.dot(extra**2) - m**2)
+    length = 1 << int(math.ceil(math.log(mean + 12*math.sqrt(variance) + 16, 2)))
+    log_transform = np.zeros(length//2 + 1, dtype=complex)
+    for e, n in averagine.items():
+        extra = _extra_neutrons(e)
+        polynomial = np.zeros(length)
+        np.add.at(polynomial, extra, symbol_to_probs[e])
+        log_transform += n*units*np.log(np.fft.rfft(polynomial))
+    pattern = np.fft.irfft(np.exp(log_transform), length)
+    pattern = np.maximum(pattern, 0.)
+    return pattern[:np.flatnonzero(pattern > 1e-12*pattern.max())[-1] + 1]
+
+
+def _tabulated_pattern(i):
+    try:
+        return _table[i]
+    except KeyError:
+        pattern = _table[i] = _pattern(i*_TABLE_STEP/averagine_mass)
+        return pattern
+
+
+def averagine_pattern(mass):
+    """
+    Returns the aggregated isotopic pattern of an averagine molecule
+    with a given average mass, interpolated linearly between
+    the tabulated patterns.
+    """
+    position = mass/_TABLE_STEP
+    i = int(position)
+    weight = position - i
+    lower = _tabulated_pattern(i)
+    upper = _tabulated_pattern(i+1)
+    pattern = np.zeros(max(len(lower), len(upper)))
+    pattern[:len(lower)] += (1. - weight)*lower
+    pattern[:len(upper)] += weight*upper
+    return pattern
+
+
+def averagine_envelope(formula, threshold=0.001, total_prob=None,
+                       charge=1, adduct=None):
+    """
+    Approximates the isotopic envelope of an ion with the averagine
+    pattern of its average mass. The peaks are placed at the exact
+    monoisotopic mass plus multiples of isotope_spacing. The envelope
+    is aggregated: the isotopic fine structure is not resolved.
+    Parameters as in the Spectrum constructor.
+    _____
+    Returns: tuple
+        A tuple of arrays of m/z values and intensities, sorted by m/z.
+    """
+    composition = _composition(formula, charge, adduct)
+    monoisotopic = sum(n*symbol_to_monoisotopic_mass[e] for e, n in composition)
+    average = sum(n*symbol_to_avg_mass[e] for e, n in composition)
+    intensity = averagine_pattern(average)
+    intensity = intensity/intensity.sum()
+    mz = (monoisotopic + isotope_spacing*np.arange(len(intensity)))/abs(charge)
+    if total_prob is not None:
+        order = np.argsort(-intensity, kind='stable')
+        covered = np.cumsum(intensity[order])
+        nb_of_peaks = min(int(np.searchsorted(covered, total_prob)) + 1, len(mz))
+        keep = np.sort(order[:nb_of_peaks])
+    else:
+        keep = intensity >= threshold*intensity.max()
+    return mz[keep], intensity[keep]
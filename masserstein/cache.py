@@ -0,0 +1,223 @@
+import os
+import re
+import hashlib
+import tempfile
+from collections import Counter, OrderedDict
+import numpy as np
+import IsoSpecPy
+
+
+def _new_file_mode():
+    """
+    Returns the permissions of files created with open(), i.e. 0666
+    restricted by the umask, to be set on files created with mkstemp.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _composition(formula, charge=1, adduct=None):
+    """
+    Parses a chemical formula, adds the adducts and returns
+    the composition as a tuple of (element, count) pairs sorted by element,
+    so that equal compositions written in different ways are equal.
+    """
+    composition = Counter()
+    for e, n in re.findall('([A-Z][a-z]*)([0-9]*)', formula):
+        composition[e] += int(n) if n else 1
+    if adduct:
+        composition[adduct] += charge
+    assert all(v >= 0 for v in composition.values())
+    return tuple(sorted((e, n) for e, n in composition.items() if n))
+
+
+def _isotopic_envelope(composition, threshold=0.001, total_prob=None, charge=1):
+    """
+    Computes the isotopic envelope of an ion with IsoSpec.
+    Returns a tuple of arrays of m/z values and intensities, sorted by m/z.
+    """
+    formula = ''.join(e + str(n) for e, n in composition)
+    if total_prob is not None:
+        isospec = IsoSpecPy.IsoTotalProb(formula=formula,
+                                         prob_to_cover=total_prob,
+                                         get_minimal_pset=True,
+                                         get_confs=False)
+    else:
+        isospec = IsoSpecPy.IsoThreshold(formula=formula,
+                                         threshold=threshold,
+                                         absolute=False,
+                                         get_confs=False)
+    mz = np.array(list(isospec.masses), dtype=np.float64) / abs(charge)
+    intensity = np.array(list(isospec.probs), dtype=np.float64)
+    order = np.argsort(mz, kind='stable')
+    return mz[order], intensity[order]
+
+
+class SpectrumCache:
+    """
+    A cache of theoretical isotopic envelopes.
+
+    Envelopes are identified by the composition of the ion (including
+    the adducts), the threshold or the total probability, and the charge.
+    The composition is normalized, so that e.g. C2H5OH and C2H6O share
+    an entry. The most recently used envelopes are kept in memory,
+    and optionally all computed envelopes are stored in a directory,
+    from which they can be reused by other processes.
+
+    The returned arrays are read-only and shared by all spectra created
+    from the same entry.
+    """
+    def __init__(self, maxsize=1024, path=None):
+        """
+        Parameters
+        ----------
+        maxsize: int
+            The maximal number of envelopes kept in memory.
+        path: str
+            A directory for the on-disk store. If None, envelopes
+            are cached only in memory. The directory is created if needed.
+        """
+        if maxsize < 0:
+            raise ValueError('Improper cache size: %i' % maxsize)
+        self.maxsize = maxsize
+        self.path = path
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+        self._envelopes = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._envelopes)
+
+    def __contains__(self, key):
+        return key in self._envelopes
+
+    @staticmethod
+    def key(formula, threshold=0.001, total_prob=None, charge=1, adduct=None):
+        """
+        Returns the normalized cache key of an envelope.
+        Parameters as in the Spectrum constructor.
+        """
+        if total_prob is not None:
+            coverage = ('total_prob', float(total_prob))
+        else:
+            coverage = ('threshold', float(threshold))
+        return (_composition(formula, charge, adduct), coverage, abs(charge))
+
+    def _file_name(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.npy')
+
+    def _load(self, key):
+        try:
+            peaks = np.load(self._file_name(key))
+        except (IOError, OSError, ValueError):
+            return None
+        return peaks[0], peaks[1]
+
+    def _store(self, key, mz, intensity):
+        # Write to a temporary file first, so that other processes
+        # never see a partially written envelope
+        handle, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as h:
+                np.save(h, np.vstack((mz, intensity)))
+            os.chmod(temporary, _new_file_mode())
+            os.replace(temporary, self._file_name(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def envelope(self, formula, threshold=0.001, total_prob=None,
+                 charge=1, adduct=None):
+        """
+        Returns the isotopic envelope of an ion, computing it only
+        if it is not cached. Parameters as in the Spectrum constructor.
+        _____
+        Returns: tuple
+            A tuple of read-only arrays of m/z values and intensities,
+            sorted by m/z.
+        """
+        key = self.key(formula, threshold, total_prob, charge, adduct)
+        try:
+            peaks = self._envelopes[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self._envelopes.move_to_end(key)
+            return peaks
+        peaks = None
+        if self.path is not None:
+            peaks = self._load(key)
+        if peaks is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            composition, coverage, charge = key
+            if coverage[0] == 'total_prob':
+                peaks = _isotopic_envelope(composition, total_prob=coverage[1],
+                                           charge=charge)
+            else:
+                peaks = _isotopic_envelope(composition, threshold=coverage[1],
+                                           charge=charge)
+            if self.path is not None:
+                self._store(key, *peaks)
+        return self._insert(key, peaks)
+
+    def _insert(self, key, peaks):
+        for a in peaks:
+            a.flags.writeable = False
+        if self.maxsize > 0:
+            self._envelopes[key] = peaks
+            if len(self._envelopes) > self.maxsize:
+                self._envelopes.popitem(last=False)
+        return peaks
+
+    def info(self):
+        """
+        Returns a dictionary with the numbers of hits in memory ('hits'),
+        hits in the on-disk store ('disk_hits'), computed envelopes
+        ('misses'), and the current and maximal number of envelopes
+        in memory ('size' and 'maxsize').
+        """
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'size': len(self._envelopes),
+                'maxsize': self.maxsize}
+
+    def clear(self):
+        """
+        Removes all envelopes from memory and resets the counters.
+        The on-disk store is left intact.
+        """
+        self._envelopes.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+# The cache used for spectra created from formulas.
+_spectrum_cache = SpectrumCache()
+
+
+def get_spectrum_cache():
+    """
+    Returns the cache of theoretical isotopic envelopes used when
+    spectra are created from formulas, or None if caching is disabled.
+    """
+    return _spectrum_cache
+
+
+def set_spectrum_cache(cache):
+    """
+    Sets the cache of theoretical isotopic envelopes used when
+    spectra are created from formulas, e.g. one with an on-disk store.
+    Set to None to disable caching.
+    """
+    global _spectrum_cache
+    _spectrum_cache = cache
@@ -0,0 +1,167 @@
+import heapq
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.spatial.distance import squareform
+from .spectrum import _worker_count
+
+
+# Spectra shared by the worker processes of pairwise_wasserstein,
+# set once per process by the pool initializer.
+_worker_spectra = None
+
+
+def _init_worker(spectra):
+    global _worker_spectra
+    _worker_spectra = spectra
+
+
+def _distance_block(rows, cols, spectra=None):
+    """
+    Computes Wasserstein distances between pairs of spectra
+    with indices given by rows and cols.
+    """
+    if spectra is None:
+        spectra = _worker_spectra
+    return np.array([spectra[i].WSDistance(spectra[j])
+                     for i, j in zip(rows, cols)], dtype=np.float64)
+
+
+def pairwise_wasserstein(spectra, n_jobs=1, condensed=False, block_size=None):
+    """
+    Returns the Wasserstein distances between all pairs of spectra.
+    Only the upper triangle of the distance matrix is computed.
+    The pairs of spectra are split into blocks which are distributed
+    over a pool of processes.
+    _____
+    Parameters:
+        spectra: list
+            A list of normalized Spectrum objects.
+        n_jobs: int
+            The number of worker processes. If 1, the distances are
+            computed in the current process. If None or -1, all available
+            CPUs are used.
+        condensed: bool
+            If True, return a condensed distance vector (the upper triangle
+            in row-major order, as returned by scipy.spatial.distance.pdist)
+            instead of a square matrix.
+        block_size: int
+            The number of pairs of spectra in a single task sent to a worker.
+            By default, the pairs are split into four blocks per worker.
+    _____
+    Returns: np.array
+        A symmetric k x k matrix of distances, or a condensed vector
+        of length k*(k-1)/2.
+    """
+    k = len(spectra)
+    for i, s in enumerate(spectra):
+        if not s.is_normalized():
+            raise ValueError('Spectrum %i is not normalized.' % i)
+    n_jobs = _worker_count(n_jobs)
+    if k < 2:
+        # No pairs; squareform would return a 1 x 1 matrix for k = 0
+        return np.zeros(0) if condensed else np.zeros((k, k))
+
+    rows, cols = np.triu_indices(k, 1)
+    nb_of_pairs = len(rows)
+    if n_jobs == 1 or nb_of_pairs == 0:
+        distances = _distance_block(rows, cols, spectra)
+    else:
+        if block_size is None:
+            block_size = -(-nb_of_pairs // (4*n_jobs))
+        block_starts = range(0, nb_of_pairs, block_size)
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_init_worker,
+                                 initargs=(spectra,)) as executor:
+            blocks = executor.map(_distance_block,
+                                  [rows[b:b+block_size] for b in block_starts],
+                                  [cols[b:b+block_size] for b in block_starts])
+            distances = np.concatenate(list(blocks))
+
+    if condensed:
+        return distances
+    return squareform(distances, checks=False)
+
+
+class SpectralLibrary:
+    """
+    A searchable collection of normalized spectra, e.g. theoretical
+    isotopic envelopes, indexed for nearest neighbour queries
+    with the Wasserstein distance.
+
+    The search uses the fact that the Wasserstein distance between
+    two spectra is at least the difference of their average masses.
+    Library spectra are sorted by average mass, and exact distances are
+    computed only for the candidates whose lower bound does not exceed
+    the distance to the k-th best spectrum found so far.
+    Note that this bound implies the one based on m/z ranges of envelopes:
+    for disjoint envelopes, the difference of average masses is at least
+    the gap between them.
+    """
+    def __init__(self, spectra):
+        """
+        Parameters
+        ----------
+        spectra: list
+            A list of normalized Spectrum objects.
+        """
+        for i, s in enumerate(spectra):
+            if not s.is_normalized():
+                raise ValueError('Spectrum %i is not normalized.' % i)
+        self.spectra = list(spectra)
+        average_masses = np.array([s.average_mass() for s in self.spectra])
+        self._order = np.argsort(average_masses, kind='stable')
+        self._average_masses = average_masses[self._order]
+
+    def __len__(self):
+        return len(self.spectra)
+
+    def search(self, query, k=1):
+        """
+        Finds k spectra from the library closest to the query.
+        _____
+        Parameters:
+            query: Spectrum
+                A normalized spectrum.
+            k: int
+                The number of nearest spectra to return.
+        _____
+        Returns: dict
+            A dictionary with entry 'indices', storing a list of indices
+            of the nearest library spectra sorted by increasing distance,
+            'distances', storing the corresponding Wasserstein distances,
+            and 'pruned', storing the number of library spectra for which
+            the exact distance was not computed.
+        """
+        if k < 1:
+            raise ValueError('Improper number of spectra to find: %i' % k)
+        n = len(self.spectra)
+        k = min(k, n)
+        mass = query.average_mass()
+        masses = self._average_masses
+        right = np.searchsorted(masses, mass)
+        left = right - 1
+        best = []  # max-heap of (-distance, index) of the k best spectra
+        computed = 0
+        while left >= 0 or right < n:
+            # Visit candidates in the order of increasing lower bounds
+            left_bound = mass - masses[left] if left >= 0 else np.inf
+            right_bound = masses[right] - mass if right < n else np.inf
+            if left_bound <= right_bound:
+                bound, position = left_bound, left
+                left -= 1
+            else:
+                bound, position = right_bound, right
+                right += 1
+            if len(best) == k and bound >= -best[0][0]:
+                break
+            idx = int(self._order[position])
+            distance = query.WSDistance(self.spectra[idx])
+            computed += 1
+            if len(best) < k:
+                heapq.heappush(best, (-distance, idx))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, idx))
+        best = sorted((-d, i) for d, i in best)
+        return {'indices': [i for _, i in best],
+                'distances': [d for d, _ in best],
+                'pruned': n - computed}
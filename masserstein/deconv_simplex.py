@@ -1,10 +1,14 @@
 import numpy as np
 from time import time
 from masserstein import Spectrum
+from masserstein.spectrum import _worker_count
 import pulp as lp
 from warnings import warn
 from decimal import Decimal
 import tempfile
+from scipy import sparse
+from scipy.optimize import linprog
+from concurrent.futures import ProcessPoolExecutor
 
 
 
@@ -31,13 +35,39 @@ def intensity_generator(confs, mzaxis):
                 yield 0.
 
 
-def dualdeconv2(exp_sp, thr_sps, penalty, quiet=True):
+# Statuses of scipy.optimize.linprog translated to PuLP statuses
+_LINPROG_STATUS = {0: lp.LpStatusOptimal,
+                   1: lp.LpStatusNotSolved,
+                   2: lp.LpStatusInfeasible,
+                   3: lp.LpStatusUnbounded,
+                   4: lp.LpStatusUndefined}
+
+
+def _check_explanation(probs, abyss):
+    # note: accounting for number of summands in checking of result correctness,
+    # because summation of many small numbers introduces numerical errors
+    if not np.isclose(sum(probs)+sum(abyss), 1., atol=len(abyss)*1e-03):
+        warn("""In dualdeconv2:
+Proportions of signal and noise sum to %f instead of 1.
+This may indicate improper results.
+Please check the deconvolution results and consider reporting this warning to the authors.
+                            """ % (sum(probs)+sum(abyss)))
+
+
+def dualdeconv2(exp_sp, thr_sps, penalty, quiet=True, backend='pulp'):
     """
     Different formulation, maybe faster
     exp_sp: experimental spectrum
     thr_sp: list of theoretical spectra
     penalty: denoising penalty
+    backend: 'pulp' to solve the linear program with PuLP (CBC),
+             or 'highs' to solve it in-process with HiGHS from SciPy
+             (see dualdeconv2_highs)
     """
+    if backend == 'highs':
+        return dualdeconv2_highs(exp_sp, thr_sps, penalty, quiet)
+    elif backend != 'pulp':
+        raise ValueError('Unknown deconvolution backend: %s' % backend)
     start = time()
     exp_confs = exp_sp.confs.copy()
     thr_confs = [thr_sp.confs.copy() for thr_sp in thr_sps]
@@ -45,9 +75,9 @@ def dualdeconv2(exp_sp, thr_sps, penalty, quiet=True):
     multiplier = 1e04  # to avoid catastrophic cancellations
     penalty *= multiplier
     # Normalization check:
-    assert np.isclose(sum(x[1] for x in exp_confs) , 1), 'Experimental spectrum not normalized'
-    for i, thrcnf in enumerate(thr_confs):
-        assert np.isclose(sum(x[1] for x in thrcnf), 1), 'Theoretical spectrum %i not normalized' % i
+    assert exp_sp.is_normalized(), 'Experimental spectrum not normalized'
+    for i, thr_sp in enumerate(thr_sps):
+        assert thr_sp.is_normalized(), 'Theoretical spectrum %i not normalized' % i
     
     # Computing a common mass axis for all spectra
     exp_confs = [(multiplier*round(m, 6), i) for m, i in exp_confs]
@@ -112,19 +142,580 @@ def dualdeconv2(exp_sp, thr_sps, penalty, quiet=True):
     exp_vec = list(intensity_generator(exp_confs, global_mass_axis))
     # 'if' clause below is to restrict returned abyss to experimental confs
     abyss = [round(x.dj, 12) for i, x in enumerate(lpVars) if exp_vec[i] > 0.]
-    # note: accounting for number of summands in checking of result correctness,
-    # because summation of many small numbers introduces numerical errors
-    if not np.isclose(sum(probs)+sum(abyss), 1., atol=len(abyss)*1e-03):
-        warn("""In dualdeconv2:
-Proportions of signal and noise sum to %f instead of 1.
-This may indicate improper results.
-Please check the deconvolution results and consider reporting this warning to the authors.
-                            """ % (sum(probs)+sum(abyss)))
+    _check_explanation(probs, abyss)
 
     return {"probs": probs, "trash": abyss, "fun": lp.value(program.objective), 'status': program.status}
 
 
-def estimate_proportions(spectrum, query, MTD=1., MDC=1e-8, MMD=-1, max_reruns=3, verbose=False):
+def _sparse_problem(exp_sp, thr_sps, multiplier):
+    """
+    Computes the common mass axis of the spectra, multiplied by multiplier,
+    the vector of experimental intensities over the axis, and a sparse
+    matrix of theoretical intensities, with one row per theoretical spectrum.
+    """
+    # Normalization check:
+    assert exp_sp.is_normalized(), 'Experimental spectrum not normalized'
+    for i, thr_sp in enumerate(thr_sps):
+        assert thr_sp.is_normalized(), 'Theoretical spectrum %i not normalized' % i
+    exp_mz = np.array([multiplier*round(m, 6) for m in exp_sp.mz.tolist()])
+    thr_mz = [np.array([multiplier*round(m, 6) for m in thr_sp.mz.tolist()])
+              for thr_sp in thr_sps]
+    global_mass_axis = np.unique(np.concatenate([exp_mz] + thr_mz))
+    n = len(global_mass_axis)
+    k = len(thr_sps)
+    exp_vec = np.zeros(n)
+    np.add.at(exp_vec, np.searchsorted(global_mass_axis, exp_mz), exp_sp.intensity)
+    rows = np.repeat(np.arange(k), [len(mz) for mz in thr_mz])
+    cols = np.concatenate([np.searchsorted(global_mass_axis, mz) for mz in thr_mz] + [np.empty(0, dtype=int)])
+    vals = np.concatenate([thr_sp.intensity for thr_sp in thr_sps] + [np.empty(0)])
+    thr_matrix = sparse.csr_matrix((vals, (rows, cols)), shape=(k, n))
+    return global_mass_axis, exp_vec, thr_matrix
+
+
+def _dual_constraints(mass_axis, thr_matrix):
+    """
+    Returns the sparse constraint matrix and the right-hand side of
+    the linear program of dualdeconv2 over the given mass axis.
+    """
+    n = len(mass_axis)
+    k = thr_matrix.shape[0]
+    interval_lengths = np.diff(mass_axis)
+    # Rows of the constraint matrix: theoretical spectra (P),
+    # then differences of consecutive variables bounded from above (EpsPlus)
+    # and from below (EpsMinus)
+    ids = np.arange(n - 1)
+    differences = sparse.csr_matrix((np.r_[np.ones(n - 1), -np.ones(n - 1)],
+                                     (np.r_[ids, ids], np.r_[ids, ids + 1])),
+                                    shape=(n - 1, n))
+    A = sparse.vstack([thr_matrix, differences, -differences], format='csr')
+    b = np.concatenate((np.zeros(k), interval_lengths, interval_lengths))
+    return A, b
+
+
+def dualdeconv2_highs(exp_sp, thr_sps, penalty, quiet=True):
+    """
+    Solves the same linear program as dualdeconv2, but builds the constraint
+    matrix directly as a sparse matrix and solves it in-process with
+    the HiGHS solver from scipy.optimize.linprog, without building
+    a PuLP model and writing it to temporary files.
+    Parameters and the returned dictionary as in dualdeconv2.
+    """
+    start = time()
+    multiplier = 1e04  # to avoid catastrophic cancellations
+    penalty *= multiplier
+    global_mass_axis, exp_vec, thr_matrix = _sparse_problem(exp_sp, thr_sps, multiplier)
+    k = len(thr_sps)
+    A, b = _dual_constraints(global_mass_axis, thr_matrix)
+    if not quiet:
+        print("Linear program with %i variables and %i constraints built" % A.shape[::-1])
+    # linprog minimizes, so the objective is negated
+    result = linprog(-exp_vec, A_ub=A, b_ub=b, bounds=(None, penalty),
+                     method='highs')
+    end = time()
+    status = _LINPROG_STATUS.get(result.status, lp.LpStatusUndefined)
+    if not quiet:
+        print("Solver finished.")
+        print("Status:", lp.LpStatus[status])
+        if result.fun is not None:
+            print("Optimal value:", -result.fun/multiplier)
+        print("Time:", end - start)
+    if result.status != 0:
+        return {"probs": [0.]*k, "trash": [0.]*int(np.count_nonzero(exp_vec > 0.)),
+                "fun": None, "status": status}
+    # Dual values of constraints and reduced costs of variables
+    # of the maximization problem
+    probs = [round(-p, 12) for p in result.ineqlin.marginals[:k].tolist()]
+    abyss = [round(-d, 12) for d in result.upper.marginals[exp_vec > 0.].tolist()]
+    _check_explanation(probs, abyss)
+
+    return {"probs": probs, "trash": abyss, "fun": -result.fun, 'status': status}
+
+
+def _primal_constraints(mass_axis, thr_matrix, penalty):
+    """
+    Returns the sparse equality constraint matrix and the cost vector
+    of the primal form of the linear program of dualdeconv2 over the given
+    mass axis. The right-hand side is the vector of experimental intensities.
+    """
+    n = len(mass_axis)
+    k = thr_matrix.shape[0]
+    interval_lengths = np.diff(mass_axis)
+    # Rows: balance of the signal at consecutive points of the mass axis
+    ids = np.arange(n - 1)
+    flows = sparse.csr_matrix((np.r_[np.ones(n - 1), -np.ones(n - 1)],
+                               (np.r_[ids, ids + 1], np.r_[ids, ids])),
+                              shape=(n, n - 1))
+    A = sparse.hstack([thr_matrix.T, flows, -flows, sparse.identity(n)], format='csc')
+    c = np.concatenate((np.zeros(k), interval_lengths, interval_lengths, np.full(n, penalty)))
+    return A, c
+
+
+def _star_chain_constraints(mass_axis, thr_matrix, penalty):
+    """
+    Returns the sparse equality constraint matrix and the cost vector
+    of the primal form of the linear program of dualdeconv2 over the given
+    mass axis, in which only the points with theoretical signal are chained.
+    The signal at any other point is transported to the closest such point
+    on its left or right, or removed, so that the rows of these points have
+    at most three nonzero coefficients and are eliminated by presolving
+    whenever the experimental intensity at the point is zero.
+    The variables are the proportions of theoretical spectra, the flows
+    between consecutive theoretical points to the right and to the left,
+    the removed signal at each point of the axis, and the flows from
+    other points to the left and to the right.
+    """
+    n = len(mass_axis)
+    k = thr_matrix.shape[0]
+    theoretical = np.diff(thr_matrix.tocsc().indptr) > 0
+    nodes = np.flatnonzero(theoretical)
+    others = np.flatnonzero(~theoretical)
+    m = len(nodes)
+    ids = np.arange(m - 1)
+    chain = sparse.csr_matrix((np.r_[np.ones(m - 1), -np.ones(m - 1)],
+                               (np.r_[nodes[ids], nodes[ids + 1]], np.r_[ids, ids])),
+                              shape=(n, m - 1))
+    right_node = np.searchsorted(nodes, others)
+    blocks = [thr_matrix.T, chain, -chain, sparse.identity(n)]
+    costs = [np.zeros(k), np.diff(mass_axis[nodes]), np.diff(mass_axis[nodes]), np.full(n, penalty)]
+    for has_node, node in ((right_node > 0, right_node - 1), (right_node < m, right_node)):
+        sources = others[has_node]
+        targets = nodes[node[has_node]]
+        ids = np.arange(len(sources))
+        blocks.append(sparse.csr_matrix((np.r_[np.ones(len(ids)), -np.ones(len(ids))],
+                                         (np.r_[sources, targets], np.r_[ids, ids])),
+                                        shape=(n, len(ids))))
+        costs.append(np.abs(mass_axis[targets] - mass_axis[sources]))
+    return sparse.hstack(blocks, format='csc'), np.concatenate(costs)
+
+
+def _primal_program(mass_axis, exp_vec, thr_matrix, penalty):
+    """
+    Solves the primal form of the linear program of dualdeconv2
+    over the given mass axis with the HiGHS dual simplex and returns
+    the result of linprog. The unexplained signal is transported between
+    consecutive points of the axis at the cost of their distance, or removed
+    at the cost of the penalty, so that each point gives one equality
+    constraint. The variables are the proportions of theoretical spectra, the flows
+    to the right, the flows to the left, and the removed signal.
+    """
+    A, c = _primal_constraints(mass_axis, thr_matrix, penalty)
+    # The program is linear in the intensities, which are rescaled so that
+    # the absolute feasibility tolerances of HiGHS do not exceed them
+    scale = 1./max(exp_vec.max(initial=0.), 1e-300)
+    result = linprog(c, A_eq=A, b_eq=scale*exp_vec, bounds=(0., None), method='highs-ds')
+    if result.status == 0:
+        result.x /= scale
+        result.fun /= scale
+    return result
+
+
+def _lipschitz_minorant(values, mass_axis):
+    """
+    Returns the largest function over mass_axis which does not exceed
+    values and changes between any two points by at most their distance.
+    """
+    forward = np.minimum.accumulate(values - mass_axis) + mass_axis
+    backward = np.minimum.accumulate((values + mass_axis)[::-1])[::-1] - mass_axis
+    return np.minimum(forward, backward)
+
+
+def dualdeconv2_approximate(exp_sp, thr_sps, penalty, gap=0., proportion_tolerance=None, quiet=True):
+    """
+    Approximately solves the linear program of dualdeconv2 by iterative
+    refinement of the mass axis. In each iteration, the points of the axis
+    are grouped into bins of equal width, and the program over the centers
+    of mass of the bins is solved in its primal form. The bin width is
+    decreased until the duality gap of the solution drops to gap, or the
+    proportions change by at most proportion_tolerance between iterations.
+    Eventually every point gets its own bin, and the exact solution is found.
+
+    The gap is computed on the original mass axis: the signal removed
+    in each bin is split between its experimental peaks proportionally
+    to their intensities, and the remaining signal is optimally transported
+    along the axis, which gives the upper bound on the optimal value.
+    The dual solution of the binned program, extended to the original axis,
+    gives the lower bound.
+    _____
+    Parameters:
+        exp_sp, thr_sps, penalty, quiet: as in dualdeconv2
+        gap: float
+            The requested duality gap, in the units of the penalty
+            (i.e. the Wasserstein distance between normalized spectra).
+        proportion_tolerance: float
+            If not None, stop when no proportion changes by more than this
+            value between consecutive iterations.
+    _____
+    Returns: dict
+        The dictionary as in dualdeconv2, with 'fun' storing the upper bound
+        on the optimal value. The entry 'gap' stores the reached duality gap
+        (in the units of the penalty), and 'iterations' the number of solved
+        linear programs.
+    """
+    start = time()
+    multiplier = 1e04  # to avoid catastrophic cancellations
+    penalty *= multiplier
+    gap *= multiplier
+    global_mass_axis, exp_vec, thr_matrix = _sparse_problem(exp_sp, thr_sps, multiplier)
+    n = len(global_mass_axis)
+    k = len(thr_sps)
+    interval_lengths = np.diff(global_mass_axis)
+    mass = exp_vec + np.asarray(thr_matrix.sum(axis=0)).ravel()
+    if gap > 0.:
+        width = min(10*gap, penalty)
+    elif proportion_tolerance is not None:
+        width = penalty
+    else:
+        width = 0.
+    previous = None
+    iterations = 0
+    while True:
+        iterations += 1
+        if width > 0.:
+            bins = np.floor((global_mass_axis - global_mass_axis[0])/width)
+            _, bins = np.unique(bins, return_inverse=True)
+            m = bins.max() + 1
+        # Bins with less than two points on average hardly reduce the program
+        exact = width == 0. or 2*m > n
+        if exact:
+            bins = np.arange(n)
+            m = n
+            centers = global_mass_axis
+        else:
+            weights = np.bincount(bins, mass, m)
+            centers = np.where(weights > 0.,
+                               np.bincount(bins, mass*global_mass_axis, m)/np.where(weights > 0., weights, 1.),
+                               np.bincount(bins, global_mass_axis, m)/np.bincount(bins, minlength=m))
+        binning = sparse.csr_matrix((np.ones(n), (np.arange(n), bins)), shape=(n, m))
+        binned_exp = binning.T.dot(exp_vec)
+        result = _primal_program(centers, binned_exp, thr_matrix.dot(binning), penalty)
+        status = _LINPROG_STATUS.get(result.status, lp.LpStatusUndefined)
+        if result.status != 0:
+            break
+        proportions = np.maximum(result.x[:k], 0.)
+        removed = np.maximum(result.x[k + 2*(m - 1):], 0.)
+        # Upper bound: removing the signal at experimental peaks of each bin
+        # and transporting the rest along the original axis
+        share = np.divide(exp_vec, binned_exp[bins], out=np.zeros(n), where=binned_exp[bins] > 0.)
+        disposed = removed[bins]*share
+        residual = exp_vec - thr_matrix.T.dot(proportions) - disposed
+        upper = penalty*disposed.sum() + interval_lengths.dot(np.abs(np.cumsum(residual)[:-1]))
+        # Lower bound: any function bounded by the penalty, changing by
+        # at most the distance between points, gives the value of the dual
+        # objective reduced by the largest violation of the constraints
+        # of theoretical spectra, as proportions sum up to at most 1.
+        duals = result.eqlin.marginals
+        lower = -np.inf
+        for candidate in (_lipschitz_minorant(duals[bins], global_mass_axis),
+                          np.interp(global_mass_axis, centers, duals)):
+            candidate = _lipschitz_minorant(np.minimum(candidate, penalty), global_mass_axis)
+            violation = max(0., thr_matrix.dot(candidate).max(initial=0.))
+            lower = max(lower, exp_vec.dot(candidate) - violation)
+        reached = max(upper - lower, 0.)
+        if not quiet:
+            print("Iteration %i: %i bins, duality gap %f" % (iterations, m, reached/multiplier))
+        if exact or reached <= gap:
+            break
+        if proportion_tolerance is not None and previous is not None and \
+           np.abs(proportions - previous).max(initial=0.) <= proportion_tolerance:
+            break
+        previous = proportions
+        # The gap is roughly proportional to the bin width
+        width *= min(max(gap/reached, 0.1), 0.5)
+    end = time()
+    if not quiet:
+        print("Solver finished.")
+        print("Status:", lp.LpStatus[status])
+        print("Time:", end - start)
+    if result.status != 0:
+        return {"probs": [0.]*k, "trash": [0.]*int(np.count_nonzero(exp_vec > 0.)),
+                "fun": None, "status": status, "gap": None, "iterations": iterations}
+    probs = [round(p, 12) for p in proportions.tolist()]
+    abyss = [round(d, 12) for d in disposed[exp_vec > 0.].tolist()]
+    _check_explanation(probs, abyss)
+
+    return {"probs": probs, "trash": abyss, "fun": upper, 'status': status,
+            'gap': reached/multiplier, 'iterations': iterations}
+
+
+class Deconvolver:
+    """
+    Deconvolves a series of experimental spectra, e.g. consecutive scans
+    of an LC-MS run, against a fixed list of theoretical spectra.
+
+    The mass axis is fixed: it consists of the peaks of theoretical spectra,
+    a regular grid spanning the range of theoretical spectra extended
+    by the penalty and/or user-supplied points, e.g. the sampling points
+    of profile spectra. The linear program of dualdeconv2 is built once
+    over this axis in its primal form, in which the experimental spectrum
+    enters only the right-hand side of the constraints. Only the points
+    with theoretical signal are chained, and the signal at other points
+    is transported to the closest of them or removed (which gives the same
+    optimal solutions), so that the points without experimental signal
+    are eliminated by presolving. Deconvolving a spectrum moves its peaks
+    to the closest points of the axis, updates the right-hand side
+    and reoptimizes the program.
+
+    If highspy is installed, the HiGHS model is kept between spectra;
+    otherwise the prebuilt program is passed to scipy.optimize.linprog.
+    """
+    def __init__(self, query, penalty, bin_width=None, mass_axis=None, warm_start=False):
+        """
+        Parameters
+        ----------
+        query: list
+            A list of normalized theoretical spectra.
+        penalty: float
+            The denoising penalty, as in dualdeconv2 (i.e. MTD
+            in estimate_proportions).
+        bin_width: float
+            If not None, a regular grid of points with this spacing,
+            spanning the range of theoretical spectra extended by the penalty,
+            is added to the mass axis. The width bounds the shift of
+            experimental peaks in this range.
+        mass_axis: array
+            If not None, m/z values added to the mass axis, e.g. the
+            sampling points of profile spectra acquired on a fixed grid.
+            Experimental peaks exactly at these points are not moved.
+        warm_start: bool
+            If True, each spectrum is reoptimized from the optimal basis
+            for the previous one, which requires highspy. This skips
+            presolving, and is faster only for consecutive spectra
+            which differ little.
+        At least one of bin_width and mass_axis needs to be supplied,
+        as otherwise the peaks would be moved to the theoretical peaks.
+        """
+        if not query:
+            raise ValueError('No theoretical spectra supplied.')
+        for i, q in enumerate(query):
+            if not q.is_normalized():
+                raise ValueError('Theoretical spectrum %i is not normalized.' % i)
+        if bin_width is None and mass_axis is None:
+            raise ValueError('Either bin_width or mass_axis needs to be supplied.')
+        if bin_width is not None and bin_width <= 0.:
+            raise ValueError('Improper bin width: %f' % bin_width)
+        self.query = list(query)
+        self._multiplier = 1e04  # to avoid catastrophic cancellations, as in dualdeconv2
+        self._penalty = penalty*self._multiplier
+        thr_mz = [np.round(q.mz, 6)*self._multiplier for q in self.query]
+        points = list(thr_mz)
+        if bin_width is not None:
+            lo = min(mz[0] for mz in thr_mz) - self._penalty
+            hi = max(mz[-1] for mz in thr_mz) + self._penalty
+            width = bin_width*self._multiplier
+            points.append(lo + width*np.arange(int(np.ceil((hi - lo)/width)) + 1))
+        if mass_axis is not None:
+            points.append(np.round(np.asarray(mass_axis, dtype=float), 6)*self._multiplier)
+        self._mass_axis = np.unique(np.concatenate(points))
+        k = len(self.query)
+        n = len(self._mass_axis)
+        rows = np.repeat(np.arange(k), [len(mz) for mz in thr_mz])
+        cols = np.concatenate([np.searchsorted(self._mass_axis, mz) for mz in thr_mz])
+        vals = np.concatenate([q.intensity for q in self.query])
+        thr_matrix = sparse.csr_matrix((vals, (rows, cols)), shape=(k, n))
+        self._A, self._c = _star_chain_constraints(self._mass_axis, thr_matrix, self._penalty)
+        # Position of the removed signal in the vector of variables
+        self._removed = k + 2*(np.count_nonzero(np.diff(self._A[:, :k].tocsr().indptr)) - 1)
+        self._warm_start = warm_start
+        try:
+            import highspy
+        except ImportError:
+            if warm_start:
+                raise ImportError('Warm starts require highspy.')
+            self._highs = None
+            return
+        model = highspy.HighsLp()
+        model.num_col_ = self._A.shape[1]
+        model.num_row_ = n
+        model.col_cost_ = self._c
+        model.col_lower_ = np.zeros(self._A.shape[1])
+        model.col_upper_ = np.full(self._A.shape[1], highspy.kHighsInf)
+        model.row_lower_ = np.zeros(n)
+        model.row_upper_ = np.zeros(n)
+        model.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        model.a_matrix_.start_ = self._A.indptr
+        model.a_matrix_.index_ = self._A.indices
+        model.a_matrix_.value_ = self._A.data
+        self._highs = highspy.Highs()
+        self._highs.setOptionValue('output_flag', False)
+        self._highs.passModel(model)
+        self._rows = np.arange(n, dtype=np.int32)
+        self._optimal = highspy.HighsModelStatus.kOptimal
+
+    def __len__(self):
+        return len(self._mass_axis)
+
+    def _solve(self, rhs):
+        """
+        Solves the program with the given right-hand side.
+        Returns the PuLP status and the optimal solution (None if not found).
+        """
+        if self._highs is None:
+            result = linprog(self._c, A_eq=self._A, b_eq=rhs, bounds=(0., None), method='highs')
+            status = _LINPROG_STATUS.get(result.status, lp.LpStatusUndefined)
+            return status, (result.x if result.status == 0 else None)
+        if not self._warm_start:
+            self._highs.clearSolver()
+        self._highs.changeRowsBounds(len(rhs), self._rows, rhs, rhs)
+        self._highs.run()
+        if self._highs.getModelStatus() != self._optimal:
+            return lp.LpStatusNotSolved, None
+        return lp.LpStatusOptimal, np.asarray(self._highs.getSolution().col_value)
+
+    def deconvolve(self, spectrum, quiet=True):
+        """
+        Estimates the proportions of theoretical spectra in a spectrum.
+        _____
+        Parameters:
+            spectrum: Spectrum
+                A normalized experimental spectrum.
+            quiet: bool
+                If False, print diagnostic messages.
+        _____
+        Returns: dict
+            A dictionary with entry 'proportions', storing a list of
+            proportions of theoretical spectra, 'noise', storing a list
+            of intensities of experimental peaks that could not be explained
+            by the theoretical spectra, and 'status', storing the status
+            of the solution as in dualdeconv2. The entry 'binning_error'
+            stores the Wasserstein distance between the spectrum and
+            its peaks moved to the mass axis, which bounds the resulting
+            change of the optimal value of the program. Peaks outside
+            of the mass axis are moved to its ends.
+        """
+        if not spectrum.is_normalized():
+            raise ValueError('The experimental spectrum is not normalized.')
+        start = time()
+        mass_axis = self._mass_axis
+        n = len(mass_axis)
+        k = len(self.query)
+        mz = np.round(spectrum.mz, 6)*self._multiplier
+        intensity = spectrum.intensity
+        closest = np.searchsorted((mass_axis[1:] + mass_axis[:-1])/2., mz)
+        exp_vec = np.bincount(closest, intensity, n)
+        # The program is linear in the intensities, which are rescaled so that
+        # the absolute feasibility tolerances of HiGHS do not exceed them
+        scale = 1./max(exp_vec.max(initial=0.), 1e-300)
+        status, x = self._solve(scale*exp_vec)
+        if not quiet:
+            print("Status:", lp.LpStatus[status])
+            print("Time:", time() - start)
+        if x is None:
+            return {'proportions': [0.]*k, 'noise': [0.]*len(mz), 'status': status,
+                    'binning_error': None}
+        # The noise of each point of the axis is split between its peaks
+        proportions = x[:k]/scale
+        removed = x[self._removed:self._removed + n]/scale
+        noise = np.divide(removed[closest]*intensity, exp_vec[closest],
+                          out=np.zeros(len(mz)), where=exp_vec[closest] > 0.)
+        proportions = np.round(proportions, 12).tolist()
+        noise = np.round(noise, 12).tolist()
+        _check_explanation(proportions, noise)
+        return {'proportions': proportions, 'noise': noise, 'status': status,
+                'binning_error': np.abs(mass_axis[closest] - mz).dot(intensity)/self._multiplier}
+
+
+def prune_envelopes(query, max_peaks=None, max_variables=None):
+    """
+    Removes the least intense peaks of theoretical spectra, so that
+    each spectrum has at most max_peaks peaks, and all spectra have
+    at most max_variables peaks in total. The modal peak of each
+    spectrum is always kept. Pruned spectra are renormalized.
+    _____
+    Parameters:
+        query: list of Spectrum objects
+            Normalized theoretical spectra.
+        max_peaks: int
+            The maximal number of peaks of a single spectrum,
+            or None for no limit.
+        max_variables: int
+            The maximal total number of peaks of all spectra,
+            or None for no limit. The peaks of all spectra are ranked
+            together by intensity.
+    _____
+    Returns: tuple
+        A tuple of a list of pruned spectra (unchanged spectra are not copied)
+        and a list of the Wasserstein distances between the original and
+        pruned spectra.
+    """
+    k = len(query)
+    if max_peaks is not None and max_peaks < 1:
+        raise ValueError('Improper maximal number of peaks: %i' % max_peaks)
+    if max_variables is not None and max_variables < k:
+        raise ValueError('The maximal number of variables (%i) is lower than the number of theoretical spectra (%i)' % (max_variables, k))
+    keep = []
+    for q in query:
+        intensity = q.intensity
+        kept = np.ones(len(intensity), dtype=bool)
+        if max_peaks is not None and len(intensity) > max_peaks:
+            order = np.argsort(-intensity, kind='stable')
+            kept[order[max_peaks:]] = False
+        keep.append(kept)
+    if max_variables is not None and sum(int(kept.sum()) for kept in keep) > max_variables:
+        priority = []
+        for q, kept in zip(query, keep):
+            p = np.where(kept, q.intensity, -1.)
+            p[np.argmax(q.intensity)] = np.inf  # modal peaks are reserved
+            priority.append(p)
+        lengths = [len(p) for p in priority]
+        priority = np.concatenate(priority)
+        order = np.argsort(-priority, kind='stable')
+        selected = np.zeros(len(priority), dtype=bool)
+        selected[order[:max_variables]] = True
+        selected &= priority >= 0.
+        keep = np.split(selected, np.cumsum(lengths)[:-1])
+    pruned = []
+    errors = []
+    for q, kept in zip(query, keep):
+        if kept.all():
+            pruned.append(q)
+            errors.append(0.)
+            continue
+        p = Spectrum.new_from_arrays(q.mz[kept], q.intensity[kept], label=q.label)
+        p.normalize()
+        pruned.append(p)
+        errors.append(q.WSDistance(p))
+    return pruned, errors
+
+
+def _deconvolve_chunk(chunk_ID, chunk_bounds, chunkSp, thrSp, MTD, max_reruns, backend, gap, proportion_tolerance):
+    """
+    Deconvolves a chunk of the experimental spectrum for estimate_proportions,
+    rerunning the computations at most max_reruns times if they fail.
+    """
+    rerun = 0
+    success = False
+    while not success:
+        rerun += 1
+        if rerun > max_reruns:
+            raise RuntimeError('Failed to deconvolve a fragment of the experimental spectrum with mass (%f, %f)' % chunk_bounds)
+        if gap is not None or proportion_tolerance is not None:
+            dec = dualdeconv2_approximate(chunkSp, thrSp, MTD, 0. if gap is None else gap,
+                                          proportion_tolerance, quiet=True)
+        else:
+            dec = dualdeconv2(chunkSp, thrSp, MTD, quiet=True, backend=backend)
+        if dec['status'] == 1:
+            success = True
+        else:
+            warn('Rerunning computations for chunk %i due to status %s' % (chunk_ID, lp.LpStatus[dec['status']]))
+    return dec
+
+
+def _deconvolve_chunks(executor, tasks, order, chunk_bounds, query, options):
+    """
+    Submits the chunks to the executor in the given order, and returns
+    the results of their deconvolution in the order of tasks.
+    """
+    futures = {}
+    for t in order:
+        chunk_ID, chunkSp, theoretical_spectra_IDs = tasks[t]
+        futures[t] = executor.submit(_deconvolve_chunk, chunk_ID, chunk_bounds[chunk_ID], chunkSp,
+                                     [query[i] for i in theoretical_spectra_IDs], *options)
+    return [futures[t].result() for t in range(len(tasks))]
+
+
+def estimate_proportions(spectrum, query, MTD=1., MDC=1e-8, MMD=-1, max_reruns=3, verbose=False,
+                         max_peaks=None, max_variables=None, backend='pulp',
+                         gap=None, proportion_tolerance=None, n_jobs=1, executor=None):
     """
     Returns estimated proportions of molecules from query in spectrum.
     Performs initial filtering of formulas and experimental spectrum to speed
@@ -158,38 +749,101 @@ def estimate_proportions(spectrum, query, MTD=1., MDC=1e-8, MMD=-1, max_reruns=3
         given by this parameter.
     verbose: bool
         Print diagnistic messages?
+    max_peaks: int
+        If not None, the theoretical spectra are pruned to at most this many
+        most intense peaks each, and renormalized, to reduce the size
+        of the linear programs (see prune_envelopes).
+    max_variables: int
+        If not None, the theoretical spectra are pruned so that they have
+        at most this many peaks in total.
+    backend: str
+        The solver of linear programs: 'pulp' (CBC via PuLP) or 'highs'
+        (HiGHS from SciPy, solved in-process). See dualdeconv2.
+    gap: float
+        If not None, the chunks are deconvolved approximately, until
+        the duality gap drops to this value (see dualdeconv2_approximate),
+        which is much faster for large chunks. The backend is then not used.
+        As the chunks are normalized, the gap bounds the difference between
+        the computed and the optimal value of the penalized Wasserstein distance
+        between the experimental spectrum and the mixture of theoretical ones.
+    proportion_tolerance: float
+        If not None, the chunks are deconvolved approximately, until
+        the proportions change by at most this value between iterations
+        (relatively to the ion current of the chunk).
+    n_jobs: int
+        The number of worker processes deconvolving the chunks in parallel.
+        If 1, the chunks are deconvolved in the current process.
+        If None or -1, all available CPUs are used.
+    executor: concurrent.futures.Executor
+        If not None, the chunks are deconvolved with this executor
+        (e.g. a pool reused for many spectra, or a ThreadPoolExecutor)
+        instead of a new pool of n_jobs processes.
+        In parallel, the chunks are submitted from the largest one.
     _____
     Returns: dict
         A dictionary with entry 'proportions', storing a list of proportions of query spectra,
         and 'noise', storing a list of intensities that could not be
         explained by the supplied formulas. The intensities correspond
         to the m/z values of experimental spectrum.
+        The entry 'pruning_error' stores the largest Wasserstein distance
+        between an original and a pruned theoretical spectrum (0 without pruning).
+        As the theoretical spectra are mixed with proportions summing up to
+        at most 1, this bounds the Wasserstein distance between the mixtures
+        of original and pruned spectra with the estimated proportions.
+        The entry 'gap' stores the reached duality gap of the whole spectrum,
+        i.e. the gaps of chunks weighted by their ion currents, as the chunks
+        are normalized before deconvolution (0 for the exact deconvolution).
+        It bounds the difference between the computed and the optimal value
+        of the penalized Wasserstein distance.
     """
     try:
         exp_confs = spectrum.confs
     except:
         print("Could not retrieve the confs list. Is the supplied spectrum an object of class Spectrum?")
         raise
-    assert abs(sum(x[1] for x in exp_confs) - 1.) < 1e-08, 'The experimental spectrum is not normalized.'
-    assert all(x[0] >= 0. for x in exp_confs), 'Found experimental peaks with negative masses!'
+    assert abs(spectrum.total_ion_current() - 1.) < 1e-08, 'The experimental spectrum is not normalized.'
+    assert spectrum.get_mz_bounds()[0] >= 0., 'Found experimental peaks with negative masses!'
     vortex = [0.]*len(exp_confs)  # unxplained signal
     k = len(query)
     proportions = [0.]*k
 
     for i, q in enumerate(query):
-        assert abs(sum(x[1] for x in q.confs) - 1.) < 1e-08, 'Theoretical spectrum %i is not normalized' %i
-        assert all(x[0] >= 0 for x in q.confs), 'Theoretical spectrum %i has negative masses!' % i
+        assert abs(q.total_ion_current() - 1.) < 1e-08, 'Theoretical spectrum %i is not normalized' %i
+        assert q.get_mz_bounds()[0] >= 0, 'Theoretical spectrum %i has negative masses!' % i
+
+    n_jobs = _worker_count(n_jobs)
+    approximate = gap is not None or proportion_tolerance is not None
+    reached_gap = 0.
+    pruning_error = 0.
+    if max_peaks is not None or max_variables is not None:
+        query, pruning_errors = prune_envelopes(query, max_peaks, max_variables)
+        pruning_error = max(pruning_errors) if pruning_errors else 0.
+        if verbose:
+            print('Pruned theoretical spectra to %i peaks in total' % sum(len(q) for q in query))
+            print('Wasserstein perturbations due to pruning:', pruning_errors)
 
     # Initial filtering of formulas
+    exp_mz = spectrum.mz
+    exp_cumsum = np.r_[0., spectrum.cumulative_intensity()]
     envelope_bounds = []
     filtered = []
     for i in range(k):
         s = query[i]
         mode = s.get_modal_peak()[0]
-        mn = s.confs[0][0]
-        mx = s.confs[-1][0]
-        matching_current = MDC==0. or sum(x[1] for x in exp_confs if x[0] >= mn - MTD and x[0] <= mx + MTD) >= MDC
-        matching_mode = MMD==-1 or min(abs(mode - x[0]) for x in exp_confs) <= MMD
+        mn, mx = s.get_mz_bounds()
+        if MDC == 0.:
+            matching_current = True
+        else:
+            lo = np.searchsorted(exp_mz, mn - MTD, side='left')
+            hi = np.searchsorted(exp_mz, mx + MTD, side='right')
+            matching_current = exp_cumsum[hi] - exp_cumsum[lo] >= MDC
+        if MMD == -1:
+            matching_mode = True
+        else:
+            # distance to the closest experimental peak
+            j = np.searchsorted(exp_mz, mode)
+            neighbours = exp_mz[max(j-1, 0):j+1]
+            matching_mode = np.abs(neighbours - mode).min() <= MMD
         if matching_mode and matching_current:
             envelope_bounds.append((mn, mx, i))
         else:
@@ -253,9 +907,8 @@ def estimate_proportions(spectrum, query, MTD=1., MDC=1e-8, MMD=-1, max_reruns=3
         print("Ion currents in chunks:", chunk_TICs)
 
     # Deconvolving chunks:
+    tasks = []  # chunk IDs, experimental chunks and IDs of their theoretical spectra
     for current_chunk_ID, conf_IDs in enumerate(exp_conf_chunks):
-        if verbose:
-            print("Deconvolving chunk %i" % current_chunk_ID)
         if chunk_TICs[current_chunk_ID] < 1e-16:
             # nothing to deconvolve, pushing remaining signal to vortex
             if verbose:
@@ -270,30 +923,45 @@ def estimate_proportions(spectrum, query, MTD=1., MDC=1e-8, MMD=-1, max_reruns=3
             chunkSp.set_confs([exp_confs[i] for i in conf_IDs])
             chunkSp.normalize()
             theoretical_spectra_IDs = [i for i, c in enumerate(chunkIDs) if c == current_chunk_ID]
-            thrSp = [query[i] for i in theoretical_spectra_IDs]
-
-            rerun = 0
-            success = False
-            while not success:
-                    rerun += 1
-                    if rerun > max_reruns:
-                            raise RuntimeError('Failed to deconvolve a fragment of the experimental spectrum with mass (%f, %f)' % chunk_bounds[current_chunk_ID])
-                    dec = dualdeconv2(chunkSp, thrSp, MTD, quiet=True)
-                    if dec['status'] == 1:
-                            success=True
-                    else:
-                            warn('Rerunning computations for chunk %i due to status %s' % (current_chunk_ID, lp.LpStatus[dec['status']]))
+            tasks.append((current_chunk_ID, chunkSp, theoretical_spectra_IDs))
+    options = (MTD, max_reruns, backend, gap, proportion_tolerance)
+    if executor is None and (n_jobs == 1 or len(tasks) < 2):
+        results = []
+        for current_chunk_ID, chunkSp, theoretical_spectra_IDs in tasks:
             if verbose:
-                    print('Chunk %i deconvolution status:', lp.LpStatus[dec['status']])
-                    print('Signal proportion:', sum(dec['probs']))
-                    print('Noise proportion:', sum(dec['trash']))
-                    print('Total explanation:', sum(dec['probs'])+sum(dec['trash']))
-            for i, p in enumerate(dec['probs']):
-                original_thr_spectrum_ID = theoretical_spectra_IDs[i]
-                proportions[original_thr_spectrum_ID] = p*chunk_TICs[current_chunk_ID]
-            for i, p in enumerate(dec['trash']):
-                original_conf_id = conf_IDs[i]
-                vortex[original_conf_id] = p*chunk_TICs[current_chunk_ID]
+                print("Deconvolving chunk %i" % current_chunk_ID)
+            results.append(_deconvolve_chunk(current_chunk_ID, chunk_bounds[current_chunk_ID], chunkSp,
+                                             [query[i] for i in theoretical_spectra_IDs], *options))
+    else:
+        if verbose:
+            print("Deconvolving %i chunks in parallel" % len(tasks))
+        # The largest chunks are submitted first, so that they do not finish last
+        sizes = [len(chunkSp) + sum(len(query[i]) for i in theoretical_spectra_IDs)
+                 for _, chunkSp, theoretical_spectra_IDs in tasks]
+        order = sorted(range(len(tasks)), key=lambda t: -sizes[t])
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                results = _deconvolve_chunks(pool, tasks, order, chunk_bounds, query, options)
+        else:
+            results = _deconvolve_chunks(executor, tasks, order, chunk_bounds, query, options)
+
+    for (current_chunk_ID, chunkSp, theoretical_spectra_IDs), dec in zip(tasks, results):
+        conf_IDs = exp_conf_chunks[current_chunk_ID]
+        if verbose:
+            print('Chunk %i deconvolution status:', lp.LpStatus[dec['status']])
+            print('Signal proportion:', sum(dec['probs']))
+            print('Noise proportion:', sum(dec['trash']))
+            print('Total explanation:', sum(dec['probs'])+sum(dec['trash']))
+            if approximate:
+                print('Duality gap:', dec['gap'])
+        if approximate:
+            reached_gap += dec['gap']*chunk_TICs[current_chunk_ID]
+        for i, p in enumerate(dec['probs']):
+            original_thr_spectrum_ID = theoretical_spectra_IDs[i]
+            proportions[original_thr_spectrum_ID] = p*chunk_TICs[current_chunk_ID]
+        for i, p in enumerate(dec['trash']):
+            original_conf_id = conf_IDs[i]
+            vortex[original_conf_id] = p*chunk_TICs[current_chunk_ID]
 
     if not np.isclose(sum(proportions)+sum(vortex), 1., atol=len(vortex)*1e-03):
         warn("""In estimate_proportions:
@@ -301,7 +969,8 @@ Proportions of signal and noise sum to %f instead of 1.
 This may indicate improper results.
 Please check the deconvolution results and consider reporting this warning to the authors.
                         """ % (sum(proportions)+sum(vortex)))
-    return {'proportions': proportions, 'noise': vortex}
+    return {'proportions': proportions, 'noise': vortex, 'pruning_error': pruning_error,
+            'gap': reached_gap}
 
 
 if __name__=="__main__":
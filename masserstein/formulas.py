@@ -0,0 +1,145 @@
+import re
+import itertools
+from collections import Counter
+
+
+# Elements and groups, optionally followed by a count or a list of ranges
+_TOKEN = re.compile(r'\s*(?:(?P<open>\()|(?P<close>\))|(?P<element>[A-Z][a-z]*))'
+                    r'(?:(?P<count>\d+)|\[(?P<ranges>[^\]]*)\])?\s*')
+# Charge signs outside of square brackets
+_CHARGE_SIGN = re.compile(r'([+-])(?![^\[]*\])')
+
+
+def _parse_ranges(text):
+    """
+    Parses a list of counts such as 2,5-7 into a sorted list of integers.
+    """
+    counts = set()
+    for part in text.split(','):
+        bounds = part.strip().split('-')
+        try:
+            if len(bounds) == 1:
+                counts.add(int(bounds[0]))
+            elif len(bounds) == 2:
+                counts.update(range(int(bounds[0]), int(bounds[1]) + 1))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError('Improper range of counts: [%s]' % text)
+    if not counts:
+        raise ValueError('Improper range of counts: [%s]' % text)
+    return sorted(counts)
+
+
+def _parse_formula(text):
+    """
+    Parses a formula with groups in parentheses and ranges of counts
+    in square brackets.
+    Returns a tuple of the composition of the fixed part of the formula
+    and a list of variable units. Each unit is a tuple of its composition,
+    the list of its counts, a multiplier of the counts (for units within
+    groups with fixed counts), and the position of its ranges in the text.
+    """
+    stack = [(Counter(), [])]
+    if not text.strip():
+        return stack[0]
+    position = 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError('Cannot parse formula: %s' % text)
+        position = match.end()
+        if match.group('open'):
+            if match.group('count') or match.group('ranges') is not None:
+                raise ValueError('Cannot parse formula: %s' % text)
+            stack.append((Counter(), []))
+            continue
+        if match.group('element'):
+            composition, units = Counter({match.group('element'): 1}), []
+        else:
+            if len(stack) == 1:
+                raise ValueError('Unbalanced parentheses in formula: %s' % text)
+            composition, units = stack.pop()
+        fixed, variable = stack[-1]
+        if match.group('ranges') is not None:
+            if units:
+                raise ValueError('Nested ranges are not supported: %s' % text)
+            variable.append((composition, _parse_ranges(match.group('ranges')),
+                             1, match.span('ranges')))
+        else:
+            n = int(match.group('count')) if match.group('count') else 1
+            for e in composition:
+                fixed[e] += n*composition[e]
+            variable.extend((u, counts, n*m, span)
+                            for u, counts, m, span in units)
+    if len(stack) != 1:
+        raise ValueError('Unbalanced parentheses in formula: %s' % text)
+    return stack[0]
+
+
+def _to_formula(composition):
+    return ''.join(e + str(n) for e, n in sorted(composition.items()) if n)
+
+
+def expand_expression(expression):
+    """
+    Expands a molecular regular expression into a series of ions.
+
+    The expression consists of a formula of the neutral molecule,
+    optionally followed by a charge sign (plus/minus) and a formula of
+    adducts. The charge is determined by the number of adduct atoms;
+    if it is negative, the adducts are subtracted from the molecule.
+    Without the adduct part, the formula is assumed to represent
+    a singly charged ion. Both formulas may contain groups in parentheses,
+    and counts of elements and groups may be given as lists of ranges
+    in square brackets. For example, CH3(CH2)[2,5-7]NH2 + H[0-1]Na[0-1]
+    expands the CH2 group 2 or from 5 to 7 times and, for each chain
+    length, adds a hydrogen, a sodium or both atoms. Uncharged
+    combinations are skipped.
+    _____
+    Returns: list
+        A list of tuples of a label (the expression with the counts
+        filled in), the formula of the ion, and its charge.
+    """
+    parts = _CHARGE_SIGN.split(expression)
+    if len(parts) == 1:
+        neutral, sign, adduct = parts[0], None, ''
+    elif len(parts) == 3:
+        neutral, sign, adduct = parts
+    else:
+        raise ValueError('Improper charge signs: %s' % expression)
+    neutral_fixed, neutral_units = _parse_formula(neutral)
+    adduct_fixed, adduct_units = _parse_formula(adduct)
+    if sign is not None and not adduct_fixed and not adduct_units:
+        raise ValueError('Missing adduct formula: %s' % expression)
+    direction = -1 if sign == '-' else 1
+
+    choices = [[(part, composition, multiplier*k, k, span) for k in counts]
+               for part, part_units in [(0, neutral_units), (1, adduct_units)]
+               for composition, counts, multiplier, span in part_units]
+    ions = []
+    for choice in itertools.product(*choices):
+        molecule = Counter(neutral_fixed)
+        adducts = Counter(adduct_fixed)
+        texts = [neutral, adduct]
+        # Fill in the counts from the right, so that the spans stay valid
+        for part, composition, n, k, (start, end) in reversed(choice):
+            target = adducts if part else molecule
+            for e in composition:
+                target[e] += n*composition[e]
+            texts[part] = texts[part][:start-1] + str(k) + texts[part][end+1:]
+        if sign is None:
+            charge = 1
+        else:
+            charge = direction*sum(adducts.values())
+        if charge == 0:
+            continue
+        for e in adducts:
+            molecule[e] += direction*adducts[e]
+        if any(n < 0 for n in molecule.values()):
+            raise ValueError('Negative numbers of atoms in: %s' % expression)
+        label = texts[0].strip()
+        if sign is not None:
+            label += ' ' + sign + ' ' + texts[1].strip()
+        ions.append((label, _to_formula(molecule), charge))
+    return ions
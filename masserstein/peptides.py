@@ -1,5 +1,8 @@
 from collections import Counter
+import itertools
 import re
+import numpy as np
+from .readers import read_fasta
 
 
 aminoacids = {
@@ -51,21 +54,163 @@ for symbol, formula in aminoacids.items():
     C = Counter(dict(zip(symbols, atom_counts)))
     daminoacids[symbol] = C
 
+# Element counts of amino acids and modifications, used to compute
+# compositions of sequences with a single pass over their bytes.
+elements = sorted(set(e for c in daminoacids.values() for e in c) |
+                  set(e for _, c in modifications for e in c))
+aminoacid_matrix = np.zeros((256, len(elements)), dtype=np.int64)
+for symbol, counter in daminoacids.items():
+    for e, n in counter.items():
+        aminoacid_matrix[ord(symbol), elements.index(e)] = n
+modification_vectors = [(desc, np.array([counter[e] for e in elements]))
+                        for desc, counter in modifications]
+water_vector = np.array([{'H': 2, 'O': 1}.get(e, 0) for e in elements])
+
+def get_protein_composition(seq, add_water=True, apply_modifications=True):
+    """
+    Returns an array of counts of elements (in the order of the list
+    `elements`) of a sequence, given as a string or bytes.
+    """
+    if isinstance(seq, str):
+        seq = seq.encode('utf-8')
+    codes = np.frombuffer(seq, dtype=np.uint8)
+    composition = np.bincount(codes, minlength=256).dot(aminoacid_matrix)
+    if add_water:
+        composition += water_vector
+    if not apply_modifications:
+        return composition
+    for mod_desc, mod_vector in modification_vectors:
+        mod_cnt = seq.count(mod_desc.encode('utf-8'))
+        if mod_cnt:
+            composition += mod_cnt*mod_vector
+    return composition
+
 def get_protein_counter(seq, add_water=True):
-    cnts = [(k, sum(char == k for char in seq)) for k in aminoacids]
-    cnts = Counter(dict(k for k in cnts if k[1] > 0))
-    return aacnt_to_elecnt(cnts, add_water=add_water)
+    composition = get_protein_composition(seq, add_water,
+                                          apply_modifications=False)
+    return Counter({e: int(n) for e, n in zip(elements, composition) if n > 0})
 
 def get_protein_formula(seq, add_water=True):
-    c = get_protein_counter(seq, add_water)
-    # Apply modifications
-    for mod_desc, mod_val in modifications:
-        mod_cnt = seq.count(mod_desc)
-        for _ in range(mod_cnt):
-            # Oh yeah, Counter supports + but does not support *.
-            # :-)
-            c += mod_val
-    return ''.join(sym+str(count) for sym,count in sorted(c.items()))
+    return composition_to_formula(get_protein_composition(seq, add_water))
+
+def composition_to_formula(composition):
+    return ''.join(e+str(n) for e, n in zip(elements, composition.tolist())
+                   if n > 0)
+
+def fasta_formulas(filename, add_water=True):
+    """
+    Reads a FASTA file sequence by sequence, and yields tuples
+    of headers and chemical formulas of the sequences.
+    """
+    for header, seq in read_fasta(filename):
+        yield header, get_protein_formula(seq, add_water)
+
+# Cleavage rules of enzymes, as regular expressions matching
+# the cleavage sites (in the style of pyteomics and ExPASy PeptideCutter).
+enzymes = {
+'trypsin' : r'(?<=[KR])(?!P)',
+'trypsin/p' : r'(?<=[KR])',
+'lys-c' : r'(?<=K)(?!P)',
+'lys-n' : r'(?=K)',
+'arg-c' : r'(?<=R)(?!P)',
+'asp-n' : r'(?=D)',
+'glu-c' : r'(?<=E)(?!P)',
+'chymotrypsin' : r'(?<=[FWY])(?!P)',
+'pepsin' : r'(?<=[FL])|(?=[FL])',
+}
+
+def digest(seq, enzyme='trypsin', missed_cleavages=0, min_length=1,
+           max_length=None):
+    """
+    Yields the peptides of an in-silico digestion of a sequence,
+    in the order of their positions. Peptides occurring several
+    times in the sequence are yielded each time.
+    _____
+    Parameters:
+        enzyme: str
+            A name of an enzyme from the `enzymes` dictionary,
+            or a regular expression matching the cleavage sites.
+        missed_cleavages: int
+            The maximal number of missed cleavage sites within a peptide.
+        min_length, max_length: int
+            Bounds on the length of peptides.
+    """
+    rule = enzymes.get(enzyme.lower(), enzyme)
+    sites = sorted(set([0, len(seq)] + [m.start() for m in re.finditer(rule, seq)]))
+    for i, start in enumerate(sites[:-1]):
+        for end in sites[i+1:i+missed_cleavages+2]:
+            length = end - start
+            if length < min_length:
+                continue
+            if max_length is not None and length > max_length:
+                break
+            yield seq[start:end]
+
+def modification_variants(peptide, variable=(), fixed=(),
+                          max_modifications=2, add_water=True):
+    """
+    Yields compositions of a peptide with all combinations of variable
+    modifications, as tuples of the element count array (see
+    get_protein_composition) and a dictionary with the number of each
+    variable modification.
+
+    Modifications are given by names from the `modifications` list, where
+    the last letter of the name is the modified amino acid, e.g. 'oxM'.
+    Fixed modifications are applied to all of their residues.
+    Each residue takes at most one modification. As the composition does
+    not depend on the positions of modifications, each combination
+    of numbers of modifications is yielded only once.
+    """
+    mod_vectors = dict(modification_vectors)
+    composition = get_protein_composition(peptide, add_water,
+                                          apply_modifications=False)
+    free_residues = Counter(peptide)
+    for mod in fixed:
+        residue = mod[-1]
+        composition = composition + free_residues[residue]*mod_vectors[mod]
+        free_residues[residue] = 0
+    # Numbers of modifications of each residue are bounded by the number
+    # of its free occurrences
+    variable = [mod for mod in variable if free_residues[mod[-1]] > 0]
+    ranges = [range(min(free_residues[mod[-1]], max_modifications) + 1)
+              for mod in variable]
+    for counts in itertools.product(*ranges):
+        if sum(counts) > max_modifications:
+            continue
+        used = Counter()
+        for mod, n in zip(variable, counts):
+            used[mod[-1]] += n
+        if any(used[r] > free_residues[r] for r in used):
+            continue
+        modified = composition
+        for mod, n in zip(variable, counts):
+            if n:
+                modified = modified + n*mod_vectors[mod]
+        yield modified, dict((mod, n) for mod, n in zip(variable, counts) if n)
+
+def digest_formulas(sequences, enzyme='trypsin', missed_cleavages=0,
+                    variable=(), fixed=(), max_modifications=2,
+                    min_length=1, max_length=None):
+    """
+    Digests sequences in silico and lazily yields the distinct chemical
+    formulas of the modified peptides, so that each isotopic envelope
+    needs to be simulated only once. Parameters as in the functions
+    digest and modification_variants.
+    _____
+    Yields: tuple
+        Tuples of a formula, the first peptide found with this formula,
+        and a dictionary with the numbers of its variable modifications.
+    """
+    seen = set()
+    for seq in sequences:
+        for peptide in digest(seq, enzyme, missed_cleavages,
+                              min_length, max_length):
+            for composition, mods in modification_variants(
+                    peptide, variable, fixed, max_modifications):
+                formula = composition_to_formula(composition)
+                if formula not in seen:
+                    seen.add(formula)
+                    yield formula, peptide, mods
 
 def aacnt_to_elecnt(cnts, add_water = True):
     if add_water:
@@ -0,0 +1,250 @@
+import base64
+import gzip
+import warnings
+import zlib
+from xml.etree import ElementTree
+import numpy as np
+
+
+def _parse_values(text):
+    """
+    Parses whitespace-separated floats from a string into an array.
+    """
+    with warnings.catch_warnings():
+        # Older NumPy versions only warn about unparsable data
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ')
+        except DeprecationWarning as e:
+            raise ValueError(str(e))
+
+
+def _is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def read_peak_list(filename, delimiter=None, chunk_size=1 << 22):
+    """
+    Reads a peak list from a text file into arrays.
+
+    The file should contain columns with m/z values and intensities,
+    one peak per line; any further columns are ignored.
+    Lines starting with a hash # are treated as comments and skipped,
+    as is a non-numeric header line. Files with names ending with .gz
+    are decompressed on the fly. The file is parsed in chunks of
+    chunk_size bytes, so that the text is never held in memory at once.
+    _____
+    Parameters:
+        filename: str
+            Path to the peak list.
+        delimiter: str
+            The column delimiter. By default, it is detected from the
+            first line of data: commas, tabs or other white space.
+        chunk_size: int
+            The number of bytes parsed at a time.
+    _____
+    Returns: tuple
+        A tuple of two float64 arrays: m/z values and intensities,
+        in the order of the file.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    chunks = []
+    nb_of_columns = None
+    remainder = b''
+    with opener(filename, 'rb') as infile:
+        while True:
+            data = infile.read(chunk_size)
+            last_chunk = not data
+            data = remainder + data
+            if not last_chunk:
+                # parse only complete lines, keep the rest for the next chunk
+                cut = data.rfind(b'\n') + 1
+                data, remainder = data[:cut], data[cut:]
+            text = data.decode('utf-8')
+            if '#' in text or nb_of_columns is None:
+                lines = [l for l in text.splitlines()
+                         if l.strip() and l.lstrip()[0] != '#']
+                if lines and nb_of_columns is None:
+                    first = lines[0]
+                    if delimiter is None:
+                        delimiter = ',' if ',' in first else None
+                    tokens = first.split(delimiter)
+                    if not _is_number(tokens[0]):
+                        lines = lines[1:]  # header line
+                        if lines:
+                            tokens = lines[0].split(delimiter)
+                    if lines:
+                        nb_of_columns = len(tokens)
+                text = '\n'.join(lines)
+            if delimiter is not None and delimiter.strip():
+                text = text.replace(delimiter, ' ')
+            if text.strip():
+                chunks.append(_parse_values(text))
+            if last_chunk:
+                break
+    if nb_of_columns is None:
+        return np.empty(0), np.empty(0)
+    if nb_of_columns < 2:
+        raise ValueError('Found less than two columns in %s' % filename)
+    values = np.concatenate(chunks)
+    if len(values) % nb_of_columns:
+        raise ValueError('Inconsistent number of columns in %s' % filename)
+    values = values.reshape(-1, nb_of_columns)
+    return values[:, 0].copy(), values[:, 1].copy()
+
+
+def read_fasta(filename):
+    """
+    Lazily reads sequences from a FASTA file.
+    Files with names ending with .gz are decompressed on the fly.
+    _____
+    Yields: tuple
+        Tuples of headers (without the leading >) and sequences,
+        in the order of the file. Lines of sequences are joined.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt') as infile:
+        header = None
+        lines = []
+        for line in infile:
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(lines)
+                header = line[1:].strip()
+                lines = []
+            elif header is not None:
+                lines.append(line.strip())
+        if header is not None:
+            yield header, ''.join(lines)
+
+
+# Controlled vocabulary accessions used by read_mzml
+_MS_LEVEL = 'MS:1000511'
+_SCAN_START_TIME = 'MS:1000016'
+_MZ_ARRAY = 'MS:1000514'
+_INTENSITY_ARRAY = 'MS:1000515'
+_FLOAT32 = 'MS:1000521'
+_FLOAT64 = 'MS:1000523'
+_ZLIB = 'MS:1000574'
+_NO_COMPRESSION = 'MS:1000576'
+_SECONDS = 'UO:0000010'
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _decode_binary_array(array_element):
+    """
+    Decodes a binaryDataArray element of an mzML file.
+    Returns a tuple with the array type accession and the float64 array.
+    """
+    dtype = '<f8'
+    compressed = False
+    array_type = None
+    text = ''
+    for child in array_element:
+        name = _local_name(child.tag)
+        if name == 'cvParam':
+            accession = child.get('accession')
+            if accession == _FLOAT32:
+                dtype = '<f4'
+            elif accession == _FLOAT64:
+                dtype = '<f8'
+            elif accession == _ZLIB:
+                compressed = True
+            elif accession in (_MZ_ARRAY, _INTENSITY_ARRAY):
+                array_type = accession
+            elif accession != _NO_COMPRESSION and 'compression' in child.get('name', ''):
+                raise ValueError('Unsupported binary data compression: %s' % child.get('name'))
+        elif name == 'binary':
+            text = child.text or ''
+    data = base64.b64decode(text)
+    if compressed:
+        data = zlib.decompress(data)
+    return array_type, np.frombuffer(data, dtype=dtype).astype(np.float64)
+
+
+def read_mzml(filename, ms_level=None, scan_range=None, rt_range=None):
+    """
+    Lazily reads spectra from an mzML file.
+
+    The file is parsed incrementally and every spectrum element is
+    discarded after it has been processed, so the memory usage does not
+    depend on the number of spectra in the file. Binary data arrays are
+    decoded only for the spectra which pass the filters.
+    Files with names ending with .gz are decompressed on the fly.
+    _____
+    Parameters:
+        ms_level: int
+            If not None, only spectra of this MS level are returned.
+        scan_range: tuple
+            If not None, a pair of the first and the last index of returned
+            spectra, inclusive. Indices are the index attributes
+            of spectra in the file, counting from 0.
+        rt_range: tuple
+            If not None, a pair of the lowest and the highest retention time
+            of returned spectra, in minutes, inclusive.
+    _____
+    Yields: Spectrum
+        Spectra in the order of the file. Each spectrum is labelled with
+        its native ID, and has additional attributes ms_level and
+        retention_time (in minutes, None if not given in the file).
+    """
+    from .spectrum import Spectrum
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as infile:
+        spectrum_list = None
+        for event, elem in ElementTree.iterparse(infile, events=('start', 'end')):
+            name = _local_name(elem.tag)
+            if event == 'start':
+                if name == 'spectrumList':
+                    spectrum_list = elem
+                continue
+            if name != 'spectrum':
+                continue
+            index = int(elem.get('index', -1))
+            if scan_range is not None and index > scan_range[1]:
+                break  # spectra are stored in the order of indices
+            selected = scan_range is None or index >= scan_range[0]
+            level = None
+            retention_time = None
+            if selected:
+                for param in elem.iter():
+                    if _local_name(param.tag) != 'cvParam':
+                        continue
+                    accession = param.get('accession')
+                    if accession == _MS_LEVEL:
+                        level = int(param.get('value'))
+                    elif accession == _SCAN_START_TIME:
+                        retention_time = float(param.get('value'))
+                        if param.get('unitAccession') == _SECONDS:
+                            retention_time /= 60.
+                if ms_level is not None and level != ms_level:
+                    selected = False
+                if rt_range is not None and (
+                        retention_time is None or
+                        not rt_range[0] <= retention_time <= rt_range[1]):
+                    selected = False
+            if selected:
+                arrays = {}
+                for array_element in elem.iter():
+                    if _local_name(array_element.tag) == 'binaryDataArray':
+                        array_type, values = _decode_binary_array(array_element)
+                        arrays[array_type] = values
+                spectrum = Spectrum.new_from_arrays(
+                    arrays.get(_MZ_ARRAY, np.empty(0)),
+                    arrays.get(_INTENSITY_ARRAY, np.empty(0)),
+                    label=elem.get('id'))
+                spectrum.ms_level = level
+                spectrum.retention_time = retention_time
+            # Free the memory taken by the processed spectrum
+            elem.clear()
+            if spectrum_list is not None:
+                spectrum_list.clear()
+            if selected:
+                yield spectrum
@@ -1,18 +1,271 @@
 import math
-import IsoSpecPy
+import os
 import numpy as np
 from scipy.stats import norm, uniform, gamma
 import random
 import heapq
-import re
-from collections import Counter
+import itertools
+import json
+import struct
+import tempfile
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
 import numpy.random as rd
+from concurrent.futures import ProcessPoolExecutor
 from .peptides import get_protein_formula
+from .readers import read_peak_list
+from .cache import SpectrumCache, get_spectrum_cache, set_spectrum_cache
+from .cache import _composition, _isotopic_envelope, _new_file_mode
+from .formulas import expand_expression
+from .averagine import averagine_envelope
+
+
+class _ConfsView(Sequence):
+    """
+    A read-only, list-like view of the peaks of a Spectrum.
+    Elements are (mz, intensity) tuples of floats, generated on demand
+    from the m/z and intensity arrays of the spectrum.
+    """
+    __slots__ = ('_spectrum',)
+
+    def __init__(self, spectrum):
+        self._spectrum = spectrum
+
+    def __len__(self):
+        return len(self._spectrum._mz)
+
+    def __getitem__(self, idx):
+        mz = self._spectrum._mz
+        intensity = self._spectrum._intensity
+        if isinstance(idx, slice):
+            return list(zip(mz[idx].tolist(), intensity[idx].tolist()))
+        return (float(mz[idx]), float(intensity[idx]))
+
+    def __iter__(self):
+        return zip(self._spectrum._mz.tolist(),
+                   self._spectrum._intensity.tolist())
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def copy(self):
+        return list(self)
+
+
+# Groups larger than this are summed one at a time with np.cumsum
+_MAX_VECTORIZED_GROUP = 16
+# Smaller pairs of spectra are compared with a plain Python loop
+_MIN_VECTORIZED_WSDISTANCE = 64
+# Binary spectrum files start with this signature,
+# followed by the header length and a JSON header
+_BINARY_MAGIC = b'MSSPEC01'
+# Relative difference of masses below which isotopologues are considered equal
+_MASS_TOLERANCE = 1e-12
+# Envelopes convolved in Spectrum.new_charge_states are simulated
+# with this many times lower threshold
+_CONVOLUTION_MARGIN = 10.
+
+
+def _worker_count(n_jobs):
+    """
+    Returns the number of worker processes for the n_jobs argument:
+    all available CPUs for None or -1, and n_jobs otherwise.
+    """
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs < 1:
+        raise ValueError('Improper number of jobs: %i' % n_jobs)
+    return n_jobs
+
+
+def _grouped_sum(values, starts):
+    """
+    Returns the sums of consecutive groups of values, where starts
+    are the indices of the first elements of the groups.
+    Values in each group are added sequentially from left to right,
+    so that the results are identical to a plain Python loop.
+    """
+    ends = np.r_[starts[1:], len(values)]
+    sizes = ends - starts
+    sums = values[starts]
+    if len(sums) == 0:
+        return sums
+    for k in range(1, min(sizes.max(), _MAX_VECTORIZED_GROUP)):
+        active = np.flatnonzero(sizes > k)
+        sums[active] += values[starts[active] + k]
+    for g in np.flatnonzero(sizes >= _MAX_VECTORIZED_GROUP):
+        sums[g] = np.cumsum(values[starts[g]:ends[g]])[-1]
+    return sums
+
+
+def _merge_sorted(mz, intensity):
+    """
+    Sums the intensities of peaks with equal m/z values and removes
+    peaks with negligible intensity. Assumes that mz is sorted.
+    Returns a tuple of the merged m/z and intensity arrays.
+    """
+    if len(mz) == 0:
+        return mz, intensity
+    starts = np.flatnonzero(np.r_[True, mz[1:] != mz[:-1]])
+    if len(starts) < len(mz):
+        mz = mz[starts]
+        intensity = _grouped_sum(intensity, starts)
+    ### TODO3: for profile spectra, set a margin of max. 5 zero intensities
+    ### around any observed intensity to preserve peak shape
+    keep = intensity > 1e-12
+    if not keep.all():
+        mz = mz[keep]
+        intensity = intensity[keep]
+    return mz, intensity
+
+
+def _convolve_envelopes(mz1, intensity1, mz2, intensity2, min_intensity=0.):
+    """
+    Returns the isotopic envelope of a sum of two molecules, given
+    their envelopes. Combinations of peaks with intensity lower than
+    min_intensity are skipped. Isotopologues with equal masses (up to
+    rounding errors) are merged. Returns a tuple of arrays sorted by mass.
+    """
+    if len(mz1) < len(mz2):
+        mz1, intensity1, mz2, intensity2 = mz2, intensity2, mz1, intensity1
+    # Each row is a shifted copy of the larger envelope, so the array
+    # consists of len(mz2) sorted runs, which the stable sort merges
+    mz = np.add.outer(mz2, mz1).ravel()
+    intensity = np.multiply.outer(intensity2, intensity1).ravel()
+    if min_intensity > 0:
+        keep = intensity >= min_intensity
+        mz = mz[keep]
+        intensity = intensity[keep]
+    if len(mz) == 0:
+        return mz, intensity
+    order = np.argsort(mz, kind='stable')
+    mz = mz[order]
+    intensity = intensity[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(mz) > _MASS_TOLERANCE*mz[1:]])
+    if len(starts) < len(mz):
+        mz = mz[starts]
+        intensity = _grouped_sum(intensity, starts)
+    return mz, intensity
+
+
+def _penalized_wasserstein(cdf_diff, interval_lengths, total_diff, penalty):
+    """
+    Computes the Wasserstein distance between two spectra in which
+    intensity can be removed instead of transported, at the cost of
+    penalty/2 per unit removed from either spectrum. Transport over
+    distances larger than penalty is therefore never used.
+
+    The dual problem is to maximize sum_i Z_i*(p_i - q_i) over 1-Lipschitz
+    functions Z bounded by penalty/2 in absolute value. It is solved by a sweep
+    over the m/z axis, keeping the concave value function of Z_i as
+    a double-ended priority queue of linear segments sorted by slope.
+    Each interval inserts one segment and trims both ends, so the sweep
+    takes O(n log n) time.
+
+    The amount of removed intensity is the derivative of the optimal value
+    with respect to the bound on Z, which is tracked alongside the value.
+
+    cdf_diff: differences of cumulative intensities on the intervals
+        between consecutive m/z values of the merged axis
+    interval_lengths: lengths of the intervals
+    total_diff: difference of total intensities of the spectra
+    Returns: a tuple of the penalized distance and the intensity removed
+        from each spectrum.
+    """
+    bound = penalty/2.
+    # Segments are lists [slope, length, derivative of length w.r.t. bound, alive]
+    highest_slope = []
+    lowest_slope = []
+    counter = itertools.count()
+
+    def push(slope, length, dlength):
+        seg = [slope, length, dlength, True]
+        i = next(counter)
+        heapq.heappush(highest_slope, (-slope, i, seg))
+        heapq.heappush(lowest_slope, (slope, i, seg))
+
+    def trim(heap, amount):
+        # Removes amount of length from the top of heap, returns the integral
+        # of the value function over the removed part and its derivative.
+        damount = 0.
+        value = 0.
+        dvalue = 0.
+        while amount > 0 and heap:
+            seg = heap[0][2]
+            if not seg[3]:
+                heapq.heappop(heap)
+            elif seg[1] <= amount:
+                amount -= seg[1]
+                damount -= seg[2]
+                value += seg[0]*seg[1]
+                dvalue += seg[0]*seg[2]
+                seg[3] = False
+                heapq.heappop(heap)
+            else:
+                seg[1] -= amount
+                seg[2] -= damount
+                value += seg[0]*amount
+                dvalue += seg[0]*damount
+                amount = 0.
+        return value, dvalue
+
+    # The value function on [-bound, bound] is represented by its value
+    # at -bound and the segments, ordered by decreasing slope from left to right.
+    push(0., 2*bound, 2.)
+    left_value = 0.
+    dleft_value = 0.
+    for slope, length in zip((-cdf_diff).tolist(), interval_lengths.tolist()):
+        if length == 0:
+            continue
+        # Z_{i+1} is within length from Z_i: the left part of the value
+        # function shifts left, the right part shifts right, and a segment
+        # with the current slope fills the gap.
+        left_value -= slope*length
+        push(slope, 2*length, 0.)
+        value, dvalue = trim(highest_slope, length)
+        left_value += value
+        dleft_value += dvalue
+        trim(lowest_slope, length)
+
+    # Maximizing the value function plus total_diff*Z over the last Z
+    optimum = left_value - total_diff*bound
+    doptimum = dleft_value - total_diff
+    for _, _, seg in lowest_slope:
+        slope = seg[0] + total_diff
+        if seg[3] and slope > 0:
+            optimum += slope*seg[1]
+            doptimum += slope*seg[2]
+    return optimum, doptimum/2.
+
+
+def _init_batch_worker(cache_path):
+    # Workers share the on-disk store of the parent's cache, if any
+    set_spectrum_cache(SpectrumCache(path=cache_path))
+
+
+def _envelope_batch(tasks):
+    """
+    Computes the isotopic envelopes for a list of tuples of arguments
+    of Spectrum.envelope_from_formula.
+    """
+    return [Spectrum.envelope_from_formula(*task) for task in tasks]
 
 
 class Spectrum:
     def __init__(self, formula='', threshold=0.001, total_prob=None,
-                 charge=1, adduct=None, confs=None, label=None, **other):
+                 charge=1, adduct=None, confs=None, label=None,
+                 approximate=False, **other):
         """Initialize a Spectrum class.
 
         Initialization can be done either by simulating a spectrum of an ion
@@ -48,10 +301,21 @@ class Spectrum:
             string.
         label: str
             An additional spectrum label.
+        approximate: bool
+            If True, the spectrum is approximated with the averagine
+            isotopic pattern of the mass of the ion, which is much faster
+            for large molecules, but does not resolve the isotopic fine
+            structure (see averagine_envelope).
+
+        The peaks are stored in two contiguous float64 arrays, available
+        as `mz` and `intensity`. The `confs` attribute is a read-only view
+        of the peaks as a list of (mz, intensity) tuples, kept for
+        compatibility.
         """
         ### TODO2: seprarate subclasses for centroid & profile spectra
         self.formula = formula
         self.empty = False
+        self._set_arrays(np.empty(0), np.empty(0))
 
         if label is None:
             self.label = formula
@@ -66,12 +330,75 @@ class Spectrum:
         elif confs is not None:
             self.set_confs(confs)
         elif formula != '':
-            self.set_confs(
-                self.confs_from_formula(
-                    formula, threshold, total_prob, charge, adduct))
+            self._set_arrays(*self.envelope_from_formula(
+                formula, threshold, total_prob, charge, adduct, approximate))
+            self.merge_confs()
         else:
             self.empty = True
-            self.confs = []
+
+    # Note: the peak arrays are never modified in place, only replaced
+    # by _set_arrays. Thanks to this, arrays can be shared between spectra,
+    # and the cache of derived statistics needs to be cleared only here.
+    def _set_arrays(self, mz, intensity):
+        self._mz = np.ascontiguousarray(mz, dtype=np.float64)
+        self._intensity = np.ascontiguousarray(intensity, dtype=np.float64)
+        self._cache = {}
+
+    def _cached(self, key, compute):
+        """
+        Returns a statistic of the peaks, computing it only if
+        the peaks changed since the last call.
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+
+    @property
+    def confs(self):
+        """
+        A read-only view of the peaks as a list of (mz, intensity) tuples.
+        """
+        return _ConfsView(self)
+
+    @property
+    def mz(self):
+        """
+        A read-only array of the m/z values of peaks.
+        """
+        view = self._mz.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def intensity(self):
+        """
+        A read-only array of the intensities of peaks.
+        """
+        view = self._intensity.view()
+        view.flags.writeable = False
+        return view
+
+    @staticmethod
+    def envelope_from_formula(formula, threshold=0.001, total_prob=None,
+                              charge=1, adduct=None, approximate=False):
+        """Simulate spectrum peaks for given formula.
+
+        Parameters as in __init__ method. `formula` must be a nonempty string.
+        Returns a tuple of arrays of m/z values and intensities, sorted
+        by m/z. Exact envelopes are cached, see get_spectrum_cache;
+        in this case, the returned arrays are read-only.
+        """
+        if approximate:
+            return averagine_envelope(formula, threshold, total_prob,
+                                      charge, adduct)
+        cache = get_spectrum_cache()
+        if cache is not None:
+            return cache.envelope(formula, threshold, total_prob,
+                                  charge, adduct)
+        return _isotopic_envelope(_composition(formula, charge, adduct),
+                                  threshold, total_prob, charge)
 
     @staticmethod
     def confs_from_formula(formula, threshold=0.001, total_prob=None,
@@ -79,53 +406,303 @@ class Spectrum:
         """Simulate and return spectrum peaks for given formula.
 
         Parameters as in __init__ method. `formula` must be a nonempty string.
+        Returns a list of (mz, intensity) tuples sorted by m/z.
         """
-        parsed = re.findall('([A-Z][a-z]*)([0-9]*)', formula)
-        formula = Counter()
-        for e, n in parsed:
-            n = int(n) if n else 1
-            formula[e] += n
-        if adduct:
-            formula[adduct] += charge
-        assert all(v >= 0 for v in formula.values())
-        formula = ''.join(x+str(formula[x]) for x in formula if formula[x])
-        if total_prob is not None:
-            isospec = IsoSpecPy.IsoTotalProb(formula=formula,
-                                             prob_to_cover=total_prob,
-                                             get_minimal_pset=True,
-                                             get_confs=False)
-        else:
-            isospec = IsoSpecPy.IsoThreshold(formula=formula,
-                                             threshold=threshold,
-                                             absolute=False,
-                                             get_confs=False)
-        confs = [(x[0]/abs(charge), x[1]) for x in
-                 zip(isospec.masses, isospec.probs)]
-        return confs
+        mz, intensity = Spectrum.envelope_from_formula(
+            formula, threshold, total_prob, charge, adduct)
+        return list(zip(mz.tolist(), intensity.tolist()))
 
     @staticmethod
-    def new_from_fasta(fasta, threshold=0.001, total_prob=None, intensity=1.0,
-                       empty=False, charge=1, label=None):
+    def new_from_fasta(fasta, threshold=0.001, total_prob=None,
+                       charge=1, adduct=None, label=None):
         return Spectrum(get_protein_formula(fasta), threshold=threshold,
-                        total_prob=total_prob, intensity=intensity,
-                        empty=empty, charge=charge, label=label)
+                        total_prob=total_prob, charge=charge, adduct=adduct,
+                        label=label)
+
+    @staticmethod
+    def new_charge_states(formula, charges, adduct='H', threshold=0.001,
+                          total_prob=None, labels=None):
+        """Simulate spectra of several charge states of a molecule.
+
+        The isotopic envelope of the molecule is computed only once,
+        for the lowest charge. The envelopes of higher charge states are
+        obtained by convolving it with the envelope of the additional
+        adducts and rescaling the m/z values. The envelopes are convolved
+        with a margin of smaller peaks, so that they differ from the ones
+        simulated by the constructor only by rounding errors.
+
+        With `total_prob`, the peaks of the convolution needed to cover
+        the probability cannot be selected without simulating much larger
+        margins, so the charge states are simulated separately.
+
+        Parameters
+        ----------
+        formula: str
+            The chemical formula of the neutral molecule.
+        charges: list
+            A list of nonzero charges. As in the constructor, a negative
+            charge removes adduct atoms from the formula.
+        adduct: str
+            The ionizing element.
+        threshold, total_prob: float
+            As in the constructor.
+        labels: list
+            Labels of the spectra. By default, spectra are labelled
+            with the formula.
+
+        Returns
+        -------
+        A list of spectra, in the order of charges.
+        """
+        charges = list(charges)
+        if not charges or 0 in charges:
+            raise ValueError('Improper charges: %s' % charges)
+        if labels is None:
+            labels = [formula]*len(charges)
+        if total_prob is not None:
+            return [Spectrum(formula, total_prob=total_prob, charge=charge,
+                             adduct=adduct, label=label)
+                    for charge, label in zip(charges, labels)]
+        margin_threshold = threshold/_CONVOLUTION_MARGIN
+        lowest = min(charges)
+        base = ''.join(e + str(n) for e, n in
+                       _composition(formula, lowest, adduct))
+        base_mz, base_intensity = Spectrum.envelope_from_formula(
+            base, margin_threshold)
+        spectra = []
+        for charge, label in zip(charges, labels):
+            mz, intensity = base_mz, base_intensity
+            if charge != lowest:
+                adduct_mz, adduct_intensity = Spectrum.envelope_from_formula(
+                    adduct + str(charge - lowest), margin_threshold)
+                # Skip combinations negligible even within the margin
+                min_intensity = (margin_threshold/_CONVOLUTION_MARGIN**2
+                                 * base_intensity.max()
+                                 * adduct_intensity.max())
+                mz, intensity = _convolve_envelopes(
+                    mz, intensity, adduct_mz, adduct_intensity, min_intensity)
+            keep = intensity >= threshold*intensity.max()
+            spectrum = Spectrum(label=label, charge=charge)
+            spectrum.formula = formula
+            spectrum.empty = False
+            spectrum._set_arrays(mz[keep] / abs(charge), intensity[keep])
+            spectrum.merge_confs()
+            spectra.append(spectrum)
+        return spectra
 
     @staticmethod
-    def new_from_csv(filename, delimiter=","):
-        spectrum = Spectrum(label=filename)
-
-        with open(filename, "r") as infile:
-            header = next(infile)
-            for line in infile:
-                if line[0] == '#':
-                    continue
-                line = line.strip()
-                line = line.split(delimiter)
-                spectrum.confs.append(tuple(map(float, line)))
+    def new_from_expression(expression, threshold=0.001, total_prob=None,
+                            n_jobs=1):
+        """Simulate spectra of a series of ions given by a molecular
+        regular expression, e.g. CH3(CH2)[2,5-7]NH2 + H[0-1]Na[0-1].
+        See expand_expression for the syntax.
+
+        The ions are simulated with batch_from_formulas, so that ions
+        with equal compositions are simulated only once, envelopes found
+        in the cache are reused and the remaining ones may be simulated
+        with n_jobs processes. The envelope of each ion is simulated
+        from its full formula, with the given threshold or total_prob.
+
+        Returns a list of spectra labelled with the expanded expressions.
+        """
+        ions = expand_expression(expression)
+        labels = [label for label, _, _ in ions]
+        formulas = [formula for _, formula, _ in ions]
+        charges = [charge for _, _, charge in ions]
+        return Spectrum.batch_from_formulas(formulas, charges,
+                                            threshold=threshold,
+                                            total_prob=total_prob,
+                                            labels=labels, n_jobs=n_jobs)
+
+    @staticmethod
+    def batch_from_formulas(formulas, charges=1, adducts=None,
+                            threshold=0.001, total_prob=None, labels=None,
+                            normalize=False, n_jobs=1, chunk_size=None,
+                            approximate=False):
+        """Simulate spectra of a list of ions in parallel.
+
+        The isotopic envelopes are simulated with a pool of processes.
+        Each distinct envelope is simulated only once, and envelopes
+        found in the cache (see get_spectrum_cache) are not simulated
+        again. Workers use the on-disk store of the cache, if it has one.
+
+        Parameters
+        ----------
+        formulas: list
+            A list of chemical formulas.
+        charges: int or list
+            A charge common to all ions, or a list of charges.
+        adducts: str or list
+            An adduct common to all ions, or a list of adducts.
+        threshold, total_prob: float
+            As in the constructor.
+        labels: list
+            Labels of the spectra. By default, spectra are labelled
+            with the formulas.
+        normalize: bool
+            If True, the spectra are normalized.
+        n_jobs: int
+            The number of worker processes. If 1, the spectra are
+            simulated in the current process. If None or -1, all available
+            CPUs are used.
+        chunk_size: int
+            The number of envelopes in a single task sent to a worker.
+            By default, the envelopes are split into four tasks per worker.
+        approximate: bool
+            If True, the envelopes are approximated as in the constructor.
+            Approximate envelopes are cheap, so they are neither cached
+            nor simulated in parallel.
+
+        Returns
+        -------
+        A list of spectra, in the order of formulas.
+        """
+        formulas = list(formulas)
+        n = len(formulas)
+        if np.ndim(charges) == 0:
+            charges = [int(charges)]*n
+        if adducts is None or isinstance(adducts, str):
+            adducts = [adducts]*n
+        if labels is None:
+            labels = formulas
+        if not len(charges) == len(adducts) == len(labels) == n:
+            raise ValueError('Different numbers of formulas, charges, '
+                             'adducts and labels.')
+        n_jobs = _worker_count(n_jobs)
+
+        cache = None if approximate else get_spectrum_cache()
+        keys = [SpectrumCache.key(f, threshold, total_prob, c, a)
+                for f, c, a in zip(formulas, charges, adducts)]
+        envelopes = {}
+        tasks = []
+        for key, f, c, a in zip(keys, formulas, charges, adducts):
+            if key in envelopes:
+                continue
+            if cache is not None and key in cache:
+                envelopes[key] = Spectrum.envelope_from_formula(
+                    f, threshold, total_prob, c, a)
+            else:
+                envelopes[key] = None
+                tasks.append((key, (f, threshold, total_prob, c, a,
+                                    approximate)))
+
+        parallel = n_jobs > 1 and len(tasks) > 1 and not approximate
+        if not parallel:
+            results = [Spectrum.envelope_from_formula(*task)
+                       for _, task in tasks]
+        else:
+            if chunk_size is None:
+                chunk_size = -(-len(tasks) // (4*n_jobs))
+            chunks = [[task for _, task in tasks[i:i+chunk_size]]
+                      for i in range(0, len(tasks), chunk_size)]
+            cache_path = cache.path if cache is not None else None
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     initializer=_init_batch_worker,
+                                     initargs=(cache_path,)) as executor:
+                results = [envelope for batch in
+                           executor.map(_envelope_batch, chunks)
+                           for envelope in batch]
+        for (key, _), envelope in zip(tasks, results):
+            if cache is not None and parallel:
+                # computed by the workers, not cached in this process yet
+                envelope = cache._insert(key, envelope)
+            envelopes[key] = envelope
+
+        spectra = []
+        for key, f, c, label in zip(keys, formulas, charges, labels):
+            spectrum = Spectrum(label=label, charge=c)
+            spectrum.formula = f
+            spectrum.empty = False
+            spectrum._set_arrays(*envelopes[key])
+            spectrum.merge_confs()
+            if normalize:
+                spectrum.normalize()
+            spectra.append(spectrum)
+        return spectra
+
+    @staticmethod
+    def new_from_arrays(mz, intensity, label=None):
+        """
+        Returns a spectrum with peaks given by arrays of m/z values
+        and intensities. The peaks are sorted and merged.
+        """
+        spectrum = Spectrum(label=label)
+        spectrum._set_arrays(mz, intensity)
         spectrum.sort_confs()
         spectrum.merge_confs()
         return spectrum
 
+    @staticmethod
+    def new_from_csv(filename, delimiter=None):
+        """
+        Reads a spectrum from a peak list file. See read_peak_list
+        for the supported formats. By default, the delimiter
+        is detected automatically.
+        """
+        mz, intensity = read_peak_list(filename, delimiter=delimiter)
+        return Spectrum.new_from_arrays(mz, intensity, label=filename)
+
+    def save(self, path):
+        """
+        Saves the spectrum in a binary file, which can be read with
+        the load method. The file consists of a short header with the label,
+        charge and formula of the spectrum, followed by raw little-endian
+        float64 arrays of m/z values and intensities.
+        """
+        header = json.dumps({'label': self.label,
+                             'charge': self.charge,
+                             'formula': self.formula,
+                             'peaks': len(self)}).encode('utf-8')
+        # pad the header so that the arrays are aligned to 8 bytes
+        header += b' ' * (-len(header) % 8)
+        # Write to a temporary file first, so that saving a spectrum
+        # memory-mapped from path does not truncate the file it reads
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as h:
+                h.write(_BINARY_MAGIC)
+                h.write(struct.pack('<Q', len(header)))
+                h.write(header)
+                self._mz.astype('<f8', copy=False).tofile(h)
+                self._intensity.astype('<f8', copy=False).tofile(h)
+            os.chmod(temporary, _new_file_mode())
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Loads a spectrum saved with the save method.
+        If mmap is True, the peak arrays are memory-mapped from the file
+        instead of being read into memory, so that processes loading
+        the same file share its pages.
+        """
+        with open(path, 'rb') as h:
+            if h.read(len(_BINARY_MAGIC)) != _BINARY_MAGIC:
+                raise ValueError('%s is not a binary spectrum file.' % path)
+            header_length, = struct.unpack('<Q', h.read(8))
+            header = json.loads(h.read(header_length).decode('utf-8'))
+            n = header['peaks']
+            if mmap and n > 0:
+                offset = h.tell()
+                mz = np.memmap(path, dtype='<f8', mode='r',
+                               offset=offset, shape=(n,))
+                intensity = np.memmap(path, dtype='<f8', mode='r',
+                                      offset=offset + 8*n, shape=(n,))
+            else:
+                mz = np.fromfile(h, dtype='<f8', count=n)
+                intensity = np.fromfile(h, dtype='<f8', count=n)
+        if len(mz) != n or len(intensity) != n:
+            raise ValueError('%s is truncated.' % path)
+        spectrum = Spectrum(label=header['label'], charge=header['charge'])
+        spectrum.formula = header['formula']
+        spectrum.empty = n == 0
+        spectrum._set_arrays(mz, intensity)
+        return spectrum
+
     @staticmethod
     def new_random(domain=(0.0, 1.0), peaks=10):
         ret = Spectrum()
@@ -135,12 +712,43 @@ class Spectrum:
         ret.set_confs(confs)
         return ret
 
+    def total_ion_current(self):
+        """
+        Returns the sum of peak intensities.
+        """
+        return self._cached('tic', lambda: float(self._intensity.sum()))
+
+    def is_normalized(self):
+        """
+        Checks whether the peak intensities sum up to 1.
+        """
+        return self._cached('normalized',
+                            lambda: bool(np.isclose(self.total_ion_current(), 1.)))
+
+    def get_mz_bounds(self):
+        """
+        Returns a tuple with the lowest and the highest m/z value.
+        """
+        return self._cached('bounds',
+                            lambda: (float(self._mz[0]), float(self._mz[-1])))
+
+    def cumulative_intensity(self):
+        """
+        Returns a read-only array of cumulative sums of peak intensities.
+        """
+        def compute():
+            cumsum = np.cumsum(self._intensity)
+            cumsum.flags.writeable = False
+            return cumsum
+        return self._cached('cumsum', compute)
+
     def average_mass(self):
         """
         Returns the average mass.
         """
-        norm = float(sum(x[1] for x in self.confs))
-        return sum(x[0]*x[1]/norm for x in self.confs)
+        return self._cached(
+            'average_mass',
+            lambda: float(np.dot(self._mz, self._intensity) / self.total_ion_current()))
 
     # def copy(self):
     #     isospec = self.isospec
@@ -154,100 +762,208 @@ class Spectrum:
         """
         Returns the peak with the highest intensity.
         """
-        return max(self.confs, key=lambda x: x[1])
+        def compute():
+            i = np.argmax(self._intensity)
+            return (float(self._mz[i]), float(self._intensity[i]))
+        return self._cached('modal_peak', compute)
 
     def sort_confs(self):
-        self.confs.sort(key = lambda x: x[0])
+        mz = self._mz
+        if np.all(mz[1:] >= mz[:-1]):
+            return
+        order = np.argsort(mz, kind='stable')
+        self._set_arrays(mz[order], self._intensity[order])
 
     def merge_confs(self):
-        cmass = self.confs[0][0]
-        cprob = 0.0
-        ret = []
-        for mass, prob in self.confs + [(-1, 0)]:
-            if mass != cmass:
-                ret.append((cmass, cprob))
-                cmass = mass
-                cprob = 0.0
-            cprob += prob
-        ### TODO3: for profile spectra, set a margin of max. 5 zero intensities
-        ### around any observed intensity to preserve peak shape
-        self.confs = [x for x in ret if x[1] > 1e-12]
+        self._set_arrays(*_merge_sorted(self._mz, self._intensity))
 
     def set_confs(self, confs):
-        self.confs = confs
+        confs = np.asarray(confs, dtype=np.float64).reshape(-1, 2)
+        self._set_arrays(confs[:, 0], confs[:, 1])
         self.sort_confs()
         self.merge_confs()
 
     def __add__(self, other):
-        res = Spectrum()
-        res.confs = self.confs + other.confs
-        res.sort_confs()
-        res.merge_confs()
-        res.label = self.label + ' + ' + other.label
+        res = Spectrum(label=self.label)
+        res._set_arrays(self._mz, self._intensity)
+        res += other
         return res
 
+    def __iadd__(self, other):
+        # Both peak lists are sorted, so the stable sort reduces to a merge
+        mz = np.concatenate((self._mz, other._mz))
+        intensity = np.concatenate((self._intensity, other._intensity))
+        order = np.argsort(mz, kind='stable')
+        self._set_arrays(*_merge_sorted(mz[order], intensity[order]))
+        self.label = self.label + ' + ' + other.label
+        return self
+
     def __mul__(self, number):
-        res = Spectrum()
-        res.set_confs([(x[0], number*x[1]) for x in self.confs])
-        res.label = self.label
+        res = Spectrum(label=self.label)
+        res._set_arrays(self._mz, self._intensity)
+        res *= number
         return res
 
+    def __imul__(self, number):
+        self._set_arrays(self._mz, number*self._intensity)
+        self.sort_confs()
+        self.merge_confs()
+        return self
+
     def __rmul__(self, number):
         # Here * is commutative
         return self * number
 
     def __len__(self):
-        return len(self.confs)
+        return len(self._mz)
+
+    @staticmethod
+    def linear_combination(spectra, weights, label=None):
+        """
+        Returns a spectrum equal to the sum of spectra multiplied by
+        the corresponding weights. The peaks of all the spectra are merged
+        in one pass, which is much faster than adding the weighted spectra
+        one by one.
+        _____
+        Parameters:
+            spectra: list
+                A list of Spectrum objects.
+            weights: list
+                A list of floats, one per spectrum.
+            label: str
+                The label of the returned spectrum. By default, the labels
+                of spectra joined with ' + '.
+        _____
+        Returns: Spectrum
+        """
+        if len(spectra) != len(weights):
+            raise ValueError('The numbers of spectra and weights differ.')
+        if label is None:
+            label = ' + '.join(s.label for s in spectra)
+        ret = Spectrum(label=label)
+        if len(spectra) == 0:
+            return ret
+        mz = np.concatenate([s._mz for s in spectra])
+        intensity = np.concatenate([w*s._intensity
+                                    for s, w in zip(spectra, weights)])
+        order = np.argsort(mz, kind='stable')
+        ret._set_arrays(*_merge_sorted(mz[order], intensity[order]))
+        return ret
 
     @staticmethod
     def ScalarProduct(spectra, weights):
         ret = Spectrum()
-        Q = [(spectra[i].confs[0], i, 0) for i in range(len(spectra))]
-        heapq.heapify(Q)
-        while Q != []:
-            conf, spectre_no, conf_idx = heapq.heappop(Q)
-            ret.confs.append((conf[0], conf[1] * weights[spectre_no]))
-            conf_idx += 1
-            if conf_idx < len(spectra[spectre_no]):
-                heapq.heappush(Q, (spectra[spectre_no].confs[conf_idx], spectre_no, conf_idx))
-        ret.merge_confs()
+        if len(spectra) == 0:
+            return ret
+        mz = np.concatenate([s._mz for s in spectra])
+        intensity = np.concatenate([s._intensity for s in spectra])
+        spectre_no = np.repeat(np.arange(len(spectra)),
+                               [len(s) for s in spectra])
+        # All peaks are merged at once, in the order of a k-way merge
+        # of the spectra: by m/z, then by intensity, then by spectrum.
+        order = np.lexsort((spectre_no, intensity, mz))
+        weights = np.asarray(weights, dtype=np.float64)
+        ret._set_arrays(*_merge_sorted(
+            mz[order], intensity[order]*weights[spectre_no[order]]))
         return ret
 
     def normalize(self, target_value = 1.0):
-        x = target_value/math.fsum(v[1] for v in self.confs)
-        self.confs = [(v[0], v[1]*x) for v in self.confs]
+        x = target_value/math.fsum(self._intensity.tolist())
+        self._set_arrays(self._mz, self._intensity*x)
 
     def WSDistanceMoves(self, other):
+        other_mz = other._mz.tolist()
+        other_intensity = other._intensity.tolist()
         try:
             ii = 0
-            leftoverprob = other.confs[0][1]
-            for mass, prob in self.confs:
+            leftoverprob = other_intensity[0]
+            for mass, prob in zip(self._mz.tolist(), self._intensity.tolist()):
                 while leftoverprob <= prob:
-                    yield (other.confs[ii][0], mass, leftoverprob)
+                    yield (other_mz[ii], mass, leftoverprob)
                     prob -= leftoverprob
                     ii += 1
-                    leftoverprob = other.confs[ii][1]
-                yield (other.confs[ii][0], mass, prob)
+                    leftoverprob = other_intensity[ii]
+                yield (other_mz[ii], mass, prob)
                 leftoverprob -= prob
         except IndexError:
             return
 
-    def WSDistance(self, other):
-        if not np.isclose(sum(x[1] for x in self.confs), 1.):
+    def WSDistanceMovesArrays(self, other, min_flow=0.):
+        """
+        Returns the optimal transport plan between self and other,
+        the same as WSDistanceMoves, but as three aligned arrays:
+        m/z values of other, m/z values of self, and the transported
+        intensity. Only moves of more than min_flow intensity are returned.
+        """
+        self_cumsum = self.cumulative_intensity()
+        other_cumsum = other.cumulative_intensity()
+        if len(self_cumsum) == 0 or len(other_cumsum) == 0:
+            return np.empty(0), np.empty(0), np.empty(0)
+        # Each move ends when the intensity of a peak of self or other
+        # is used up, i.e. at a breakpoint of either cumulative sum.
+        total = min(self_cumsum[-1], other_cumsum[-1])
+        breakpoints = np.concatenate((self_cumsum, other_cumsum))
+        breakpoints.sort(kind='stable')
+        breakpoints = breakpoints[breakpoints <= total]
+        flow = np.diff(breakpoints, prepend=0.)
+        keep = flow > min_flow
+        breakpoints = breakpoints[keep]
+        self_idx = np.searchsorted(self_cumsum, breakpoints, side='left')
+        other_idx = np.searchsorted(other_cumsum, breakpoints, side='left')
+        return other._mz[other_idx], self._mz[self_idx], flow[keep]
+
+    def WSDistance(self, other, penalty=None):
+        """
+        Returns the Wasserstein distance between two normalized spectra.
+        In one dimension, the distance is equal to the integral of
+        the absolute difference of cumulative distribution functions,
+        which is computed on the merged m/z axes of both spectra.
+
+        If penalty is not None, intensity may be removed from the spectra
+        as noise instead of being transported, at the cost of penalty/2
+        per unit of intensity removed from each spectrum, so that removing
+        a unit from both spectra costs penalty. The penalty is therefore
+        the maximum transport distance, as in estimate_proportions.
+        In this case, a tuple is returned with the penalized distance
+        (the transport cost plus the penalty for removed intensity)
+        and the intensity removed from each spectrum.
+        """
+        if not self.is_normalized():
             raise ValueError('Self is not normalized.')
-        if not np.isclose(sum(x[1] for x in other.confs), 1.):
+        if not other.is_normalized():
             raise ValueError('Other is not normalized.')
-        return math.fsum(abs(x[0]-x[1])*x[2] for x in self.WSDistanceMoves(other))
+        if penalty is not None:
+            if penalty <= 0:
+                raise ValueError('Improper penalty value: %f' % penalty)
+            axis = np.concatenate((self._mz, other._mz))
+            order = np.argsort(axis, kind='stable')
+            axis = axis[order]
+            if penalty >= axis[-1] - axis[0]:
+                # no transport is long enough to make removal worthwhile
+                return self.WSDistance(other), 0.
+            cdf_diff = np.concatenate((self._intensity, -other._intensity))[order]
+            cdf_diff = np.cumsum(cdf_diff)
+            distance, removed = _penalized_wasserstein(
+                cdf_diff[:-1], np.diff(axis), cdf_diff[-1], penalty)
+            return float(distance), float(removed)
+        if len(self) + len(other) < _MIN_VECTORIZED_WSDISTANCE:
+            # For a handful of peaks, NumPy call overheads dominate
+            return math.fsum(abs(x[0]-x[1])*x[2] for x in self.WSDistanceMoves(other))
+        axis = np.concatenate((self._mz, other._mz))
+        order = np.argsort(axis, kind='stable')  # merges the two sorted runs
+        axis = axis[order]
+        # Differences of the CDFs on intervals between consecutive m/z values
+        cdf_diff = np.concatenate((self._intensity, -other._intensity))[order]
+        cdf_diff = np.cumsum(cdf_diff[:-1])
+        return float(np.dot(np.abs(cdf_diff), np.diff(axis)))
 
     def explained_intensity(self,other):
         """
         Returns the amount of mutual intensity between self and other,
         defined as sum of minima of intensities, mass-wise.
         """
-        e = 0
-        for i in range(len(self.confs)):
-            e += min(self.confs[i][1],other.confs[i][1])
-        return e
+        n = len(self._intensity)
+        return float(np.minimum(self._intensity, other._intensity[:n]).sum())
 
     def bin_to_nominal(self, nb_of_digits=0):
         """
@@ -258,11 +974,8 @@ class Spectrum:
         The default nb_of_digits is zero, meaning that the m/z values
         will correspond to nominal mass of peaks.
         """
-        xcoord, ycoord = zip(*self.confs)
-        xcoord = map(lambda x: x*self.charge, xcoord)
-        xcoord = (round(x, nb_of_digits) for x in xcoord)
-        xcoord = map(lambda x: x/self.charge, xcoord)
-        self.confs = list(zip(xcoord, ycoord))
+        xcoord = np.round(self._mz*self.charge, nb_of_digits)/self.charge
+        self._set_arrays(xcoord, self._intensity)
         self.sort_confs()
         self.merge_confs()
 
@@ -270,7 +983,7 @@ class Spectrum:
         """
         Rounds the m/z to a given number of decimal digits
         """
-        self.confs = [(round(x[0], nb_of_digits), x[1]) for x in self.confs]
+        self._set_arrays(np.round(self._mz, nb_of_digits), self._intensity)
         self.merge_confs()
 
     def add_chemical_noise(self, nb_of_noise_peaks, noise_fraction):
@@ -284,28 +997,29 @@ class Spectrum:
         Return: list
             A boolean list indicating if a given peak corresponds to noise
         """
-        span = min(x[0] for x in self.confs), max(x[0] for x in self.confs)
+        span = self._mz.min(), self._mz.max()
         span_increase = 1.2  # increase the mass range by a factor of 1.2
         span = [span_increase*x + (1-span_increase)*sum(span)/2 for x in span]
         noisex = uniform.rvs(loc=span[0], scale=span[1]-span[0], size=nb_of_noise_peaks)
         noisey = gamma.rvs(a=2, scale=2, size=nb_of_noise_peaks)
         noisey /= sum(noisey)
-        signal = sum(x[1] for x in self.confs)
+        signal = self.total_ion_current()
         noisey *=  signal*noise_fraction /(1-noise_fraction)
-        noise = [(x, y) for x,y in zip(noisex, noisey)]
-        self.confs += noise
+        self._set_arrays(np.concatenate((self._mz, noisex)),
+                         np.concatenate((self._intensity, noisey)))
         self.sort_confs()
         self.merge_confs()
-        return [True if mz in noisex else False for mz in [x[0] for x in self.confs]]
+        return np.isin(self._mz, noisex).tolist()
 
     def add_gaussian_noise(self, sd):
         """
         Adds gaussian noise to each peak, simulating
         electronic noise.
         """
-        noised = rd.normal([y for x,y in self.confs], sd)
+        noised = rd.normal(self._intensity, sd)
         # noised = noised - min(noised)
-        self.confs = [(x[0], y) for x, y in zip(self.confs, noised) if y > 0]
+        keep = noised > 0
+        self._set_arrays(self._mz[keep], noised[keep])
 
     def distort_intensity(self, N, gain, sd):
         """
@@ -325,14 +1039,13 @@ class Spectrum:
         Return: np.array
             The applied deviations.
         """
-        p = np.array([x[1] for x in self.confs])
-        assert np.isclose(sum(p), 1), 'Spectrum needs to be normalized prior to distortion'
-        X = [(x[0], N*gain*x[1]) for x in self.confs]  # average signal
+        p = self._intensity
+        assert self.is_normalized(), 'Spectrum needs to be normalized prior to distortion'
+        X = N*gain*p  # average signal
         peakSD = np.sqrt(N*sd**2*p + N*gain**2*p*(1-p))
         U = rd.normal(0, 1, len(X))
         U *= peakSD
-        X = [(x[0], max(x[1] + u, 0.)) for x, u in zip(X, U)]
-        self.confs = X
+        self._set_arrays(self._mz, np.maximum(X + U, 0.))
         return U
 
     def distort_mz(self, mean, sd):
@@ -342,8 +1055,8 @@ class Spectrum:
         Use non-zero mean to approximate calibration error.
         Returns the applied shift.
         """
-        N = rd.normal(mean, sd, len(self.confs))
-        self.confs = [(x[0] + u, x[1]) for x, u in zip(self.confs, N)]
+        N = rd.normal(mean, sd, len(self._mz))
+        self._set_arrays(self._mz + N, self._intensity)
         self.sort_confs()
         self.merge_confs()
         return N
@@ -362,12 +1075,14 @@ class Spectrum:
         sd: float
             Standard deviation of one ion's signal
         """
-        p = [x[1] for x in reference.confs]
-        assert np.isclose(sum(p), 1), 'Spectrum needs to be normalized prior to sampling'
+        p = reference._intensity
+        assert reference.is_normalized(), 'Spectrum needs to be normalized prior to sampling'
         U = rd.multinomial(N, p)
         U = rd.normal(U*gain, np.sqrt(U*sd**2))
         retSp = Spectrum('', empty=True, label='Sampled ' + reference.label)
-        retSp.set_confs([(x[0], max(u, 0.)) for x, u in zip(reference.confs, U)])
+        retSp._set_arrays(reference._mz, np.maximum(U, 0.))
+        retSp.sort_confs()
+        retSp.merge_confs()
         return retSp
 
     def find_peaks(self):
@@ -380,10 +1095,10 @@ class Spectrum:
         Applying a gaussian or Savitzky-Golay filter prior to peak picking
         is advised in order to avoid detection of noise.
         """
-        diffs = [n[1]-p[1] for n,p in zip(self.confs[1:], self.confs[:-1])]
-        is_max = [nd <0 and pd > 0 for nd, pd in zip(diffs[1:], diffs[:-1])]
-        peaks = [x for x, p in zip(self.confs[1:-1], is_max) if p]
-        return peaks
+        diffs = np.diff(self._intensity)
+        is_max = np.flatnonzero((diffs[1:] < 0) & (diffs[:-1] > 0)) + 1
+        return list(zip(self._mz[is_max].tolist(),
+                        self._intensity[is_max].tolist()))
 
     def centroid(self, max_width, peak_height_fraction=0.5):
         """
@@ -400,12 +1115,11 @@ class Spectrum:
         is advised in order to avoid detection of noise.
         """
         # Find the local maxima of intensity:
-        diffs = [n[1]-p[1] for n,p in zip(self.confs[1:], self.confs[:-1])]
-        is_max = [nd <0 and pd > 0 for nd, pd in zip(diffs[1:], diffs[:-1])]
-        peak_indices = [i+1 for i, m in enumerate(is_max) if m]
+        diffs = np.diff(self._intensity)
+        peak_indices = np.flatnonzero((diffs[1:] < 0) & (diffs[:-1] > 0)) + 1
 
-        mz=np.array([x[0] for x in self.confs])
-        intsy=np.array([x[1] for x in self.confs])
+        mz = self._mz
+        intsy = self._intensity
         centroid_mz = []
         centroid_intensity = []
         max_dist = max_width/2.
@@ -440,10 +1154,10 @@ class Spectrum:
         Note that after the filtering, the area below curve is equal to 1,
         instead of the sum of 'peak' intensities!
         """
-        new_mass = np.arange(self.confs[0][0] - 4*sd, self.confs[-1][0] + 4*sd, step)
+        new_mass = np.arange(self._mz[0] - 4*sd, self._mz[-1] + 4*sd, step)
         new_intensity = np.zeros(len(new_mass))
         lb = new_mass[0]
-        for x, y in self.confs:
+        for x, y in zip(self._mz.tolist(), self._intensity.tolist()):
             xrnb = int((x-lb)//step)  # x's index in new_mass
             xr = lb + step*xrnb
             lnb = int((xr-x+4*sd)//step)   # nb of steps left of x to add gauss
@@ -452,19 +1166,21 @@ class Spectrum:
             xv = np.array([xlb + i*step for i in range(2*lnb + 2)])
             nv = y*norm.pdf(xv, x, sd)
             new_intensity[(xrnb-lnb):(xrnb+lnb+2)] += nv
-        self.confs = [(x, y) for x, y in zip(new_mass, new_intensity)]
+        self._set_arrays(new_mass, new_intensity)
 
     def cut_smallest_peaks(self, removed_proportion=0.001):
         """
         Removes smallest peaks until the total removed intensity amounts
         to the given proportion of the total ion current in the spectrum.
         """
-        self.confs.sort(key = lambda x: x[1], reverse=True)
-        threshold  = removed_proportion*sum(x[1] for x in self.confs)
-        removed = 0
-        while len(self.confs)>0 and removed + self.confs[-1][1] <= threshold:
-            removed += self.confs.pop()[1]
-        self.confs.sort(key = lambda x: x[0])
+        # smallest peaks first; among equal intensities, larger m/z first
+        order = np.argsort(-self._intensity, kind='stable')[::-1]
+        threshold  = removed_proportion*self.total_ion_current()
+        removed = np.cumsum(self._intensity[order])
+        nb_removed = np.searchsorted(removed, threshold, side='right')
+        keep = np.ones(len(self._mz), dtype=bool)
+        keep[order[:nb_removed]] = False
+        self._set_arrays(self._mz[keep], self._intensity[keep])
 
     def filter_peaks(self, list_of_others, margin):
         """
@@ -514,29 +1230,22 @@ class Spectrum:
         Spectrum
             An empirical spectrum with filtered out peaks.
         """
-        try:
-            th_confs = []
-            for theoretical_spectrum in theoreticals:
-                th_confs.extend(theoretical_spectrum.confs)
-            theoretical = Spectrum()
-            theoretical.set_confs(th_confs)
-        except TypeError:
+        if isinstance(theoreticals, Spectrum):
             theoretical = theoreticals
-        experimental_confs = experimental.confs
-        theoretical_masses = [i[0] for i in theoretical.confs]
-
-        result_confs = []
-        index = 0
-        for mz, abund in experimental_confs:
-            while (index + 1 < len(theoretical_masses) and
-                   theoretical_masses[index + 1] < mz):
-                index += 1
-            if abs(mz - theoretical_masses[index]) <= margin or (
-                    index + 1 < len(theoretical_masses) and
-                    abs(mz - theoretical_masses[index + 1]) <= margin):
-                result_confs.append((mz, abund))
+        else:
+            theoreticals = list(theoreticals)
+            theoretical = Spectrum.linear_combination(theoreticals, [1.]*len(theoreticals))
+        mz = experimental._mz
+        theoretical_masses = theoretical._mz
+
+        # index of the last theoretical mass lower than mz, if any
+        index = np.searchsorted(theoretical_masses, mz, side='left') - 1
+        index = np.maximum(index, 0)
+        next_index = np.minimum(index + 1, len(theoretical_masses) - 1)
+        keep = ((np.abs(mz - theoretical_masses[index]) <= margin) |
+                (np.abs(mz - theoretical_masses[next_index]) <= margin))
         new_spectrum = Spectrum(label=experimental.label)
-        new_spectrum.confs = result_confs
+        new_spectrum._set_arrays(mz[keep], experimental._intensity[keep])
         return new_spectrum
 
     def plot(self, show = True, profile=False, linewidth=1, **plot_kwargs):
@@ -544,11 +1253,11 @@ class Spectrum:
         if show:
             plt.clf()
         if profile:
-            plt.plot([x[0] for x in self.confs], [x[1] for x in self.confs],
+            plt.plot(self._mz, self._intensity,
                      linestyle='-', label=self.label, **plot_kwargs)
         else:
-            plt.vlines([x[0] for x in self.confs], [0],
-                       [x[1] for x in self.confs], label = self.label,
+            plt.vlines(self._mz, [0],
+                       self._intensity, label = self.label,
                        linewidth=linewidth, **plot_kwargs)
         if show:
             plt.show()
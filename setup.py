@@ -147,7 +147,7 @@ setup(
     #
     # For an analysis of "install_requires" vs pip's requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['IsoSpecPy', 'numpy', 'scipy', 'pulp'],  
+    install_requires=['IsoSpecPy', 'numpy', 'scipy>=1.7', 'pulp'],  
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). Users will be able to install these using the "extras"
@@ -159,6 +159,7 @@ setup(
     # projects.
     extras_require={  # Optional
         'graphics': ['matplotlib'],
+        'highs': ['highspy'],
     },
 
     # If there are data files included in your packages that need to be
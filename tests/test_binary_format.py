@@ -0,0 +1,38 @@
+import os
+import stat
+import numpy as np
+from masserstein import Spectrum
+
+
+def test_save_load_round_trip(tmp_path):
+    s = Spectrum(confs=[(100., 0.25), (101., 0.5), (102., 0.25)], label='test')
+    path = str(tmp_path / 'spectrum.bin')
+    s.save(path)
+    for mmap in (True, False):
+        loaded = Spectrum.load(path, mmap=mmap)
+        assert loaded.label == 'test'
+        assert np.array_equal(loaded.mz, s.mz)
+        assert np.array_equal(loaded.intensity, s.intensity)
+
+
+def test_save_onto_memory_mapped_source(tmp_path):
+    s = Spectrum.new_from_arrays(np.arange(100., 1100.), np.linspace(1., 2., 1000))
+    path = str(tmp_path / 'spectrum.bin')
+    s.save(path)
+    loaded = Spectrum.load(path)
+    loaded.save(path)
+    reloaded = Spectrum.load(path)
+    assert np.array_equal(reloaded.mz, s.mz)
+    assert np.array_equal(reloaded.intensity, s.intensity)
+    assert [f.name for f in tmp_path.iterdir()] == ['spectrum.bin']
+
+
+def test_saved_file_permissions_follow_umask(tmp_path):
+    s = Spectrum(confs=[(100., 0.5), (101., 0.5)])
+    path = str(tmp_path / 'spectrum.bin')
+    umask = os.umask(0o022)
+    try:
+        s.save(path)
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
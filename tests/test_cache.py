@@ -0,0 +1,58 @@
+import os
+import stat
+import numpy as np
+from masserstein import SpectrumCache
+
+
+def test_equal_compositions_share_a_key():
+    assert SpectrumCache.key('C2H5OH') == SpectrumCache.key('C2H6O')
+    assert SpectrumCache.key('C2H5OH') != SpectrumCache.key('C2H6O', charge=2)
+    assert SpectrumCache.key('C2H5OH') != SpectrumCache.key('C2H6O', threshold=0.01)
+    cache = SpectrumCache()
+    first = cache.envelope('C2H5OH')
+    second = cache.envelope('C2H6O')
+    assert second[0] is first[0]
+    assert cache.info()['hits'] == 1 and cache.info()['misses'] == 1
+
+
+def test_counters_and_eviction():
+    cache = SpectrumCache(maxsize=2)
+    cache.envelope('C2H6O')
+    cache.envelope('CH4')
+    cache.envelope('C2H6O')  # now the most recently used
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 0, 2)
+    cache.envelope('H2O')  # evicts CH4
+    assert len(cache) == 2
+    assert SpectrumCache.key('CH4') not in cache
+    assert SpectrumCache.key('C2H6O') in cache
+    cache.envelope('CH4')
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 0, 4)
+    assert cache.info() == {'hits': 1, 'disk_hits': 0, 'misses': 4,
+                            'size': 2, 'maxsize': 2}
+    cache.clear()
+    assert len(cache) == 0 and cache.misses == 0
+
+
+def test_disabled_memory_cache():
+    cache = SpectrumCache(maxsize=0)
+    cache.envelope('CH4')
+    cache.envelope('CH4')
+    assert len(cache) == 0 and cache.misses == 2
+
+
+def test_disk_store_shared_between_caches(tmp_path):
+    path = str(tmp_path / 'store')
+    umask = os.umask(0o022)
+    try:
+        mz, intensity = SpectrumCache(path=path).envelope('C6H12O6')
+    finally:
+        os.umask(umask)
+    files = os.listdir(path)
+    assert len(files) == 1 and files[0].endswith('.npy')
+    assert stat.S_IMODE(os.stat(os.path.join(path, files[0])).st_mode) == 0o644
+    other = SpectrumCache(path=path)
+    loaded_mz, loaded_intensity = other.envelope('C6H12O6')
+    assert (other.hits, other.disk_hits, other.misses) == (0, 1, 0)
+    assert np.array_equal(loaded_mz, mz)
+    assert np.array_equal(loaded_intensity, intensity)
+    assert not loaded_mz.flags.writeable
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from masserstein import Spectrum, SpectralLibrary, pairwise_wasserstein
+
+
+def _random_spectra(seed, k):
+    rng = np.random.default_rng(seed)
+    spectra = []
+    for _ in range(k):
+        n = rng.integers(1, 8)
+        s = Spectrum.new_from_arrays(np.sort(rng.uniform(100., 110., n)), rng.uniform(0.1, 1., n))
+        s.normalize()
+        spectra.append(s)
+    return spectra
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_pairwise_wasserstein_matches_double_loop(n_jobs):
+    spectra = _random_spectra(0, 9)
+    expected = np.array([[p.WSDistance(q) for q in spectra] for p in spectra])
+    distances = pairwise_wasserstein(spectra, n_jobs=n_jobs, block_size=5)
+    assert distances.shape == (9, 9)
+    assert np.allclose(distances, expected, rtol=0., atol=1e-12)
+    condensed = pairwise_wasserstein(spectra, n_jobs=n_jobs, condensed=True)
+    assert np.allclose(condensed, expected[np.triu_indices(9, 1)], rtol=0., atol=1e-12)
+
+
+def test_pairwise_wasserstein_without_pairs():
+    assert pairwise_wasserstein([]).shape == (0, 0)
+    assert pairwise_wasserstein([], condensed=True).shape == (0,)
+    spectra = _random_spectra(1, 1)
+    assert np.array_equal(pairwise_wasserstein(spectra), np.zeros((1, 1)))
+    assert pairwise_wasserstein(spectra, condensed=True).shape == (0,)
+
+
+def test_pairwise_wasserstein_checks_arguments():
+    spectra = _random_spectra(2, 3)
+    with pytest.raises(ValueError):
+        pairwise_wasserstein(spectra, n_jobs=0)
+    spectra[1] = Spectrum.new_from_arrays(np.array([100.]), np.array([2.]))
+    with pytest.raises(ValueError):
+        pairwise_wasserstein(spectra)
+
+
+def _library(seed, n):
+    rng = np.random.default_rng(seed)
+    spectra = []
+    for centre in rng.uniform(100., 1000., n):
+        m = rng.integers(2, 6)
+        s = Spectrum.new_from_arrays(centre + np.arange(m)*1.003, rng.uniform(0.1, 1., m))
+        s.normalize()
+        spectra.append(s)
+    return spectra
+
+
+@pytest.mark.parametrize('k', [1, 5])
+def test_library_search_matches_brute_force(monkeypatch, k):
+    library = SpectralLibrary(_library(3, 300))
+    calls = []
+    distance = Spectrum.WSDistance
+
+    def counted(self, other, *args, **kwargs):
+        calls.append(other)
+        return distance(self, other, *args, **kwargs)
+
+    total_pruned = 0
+    for query in _library(4, 10):
+        expected = np.array([query.WSDistance(s) for s in library.spectra])
+        monkeypatch.setattr(Spectrum, 'WSDistance', counted)
+        del calls[:]
+        result = library.search(query, k=k)
+        monkeypatch.setattr(Spectrum, 'WSDistance', distance)
+        assert np.allclose(result['distances'], np.sort(expected)[:k], rtol=0., atol=1e-12)
+        assert np.allclose(expected[result['indices']], result['distances'], rtol=0., atol=1e-12)
+        # 'pruned' counts the library spectra without an exact distance
+        assert result['pruned'] == len(library) - len(calls)
+        total_pruned += result['pruned']
+    assert total_pruned > 0
+
+
+def test_library_search_arguments():
+    library = SpectralLibrary(_library(5, 3))
+    query = _library(6, 1)[0]
+    assert len(library.search(query, k=10)['indices']) == 3
+    with pytest.raises(ValueError):
+        library.search(query, k=0)
@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+from masserstein import Spectrum, Deconvolver, estimate_proportions
+from masserstein.deconv_simplex import dualdeconv2, dualdeconv2_approximate
+from masserstein.deconv_simplex import _sparse_problem, _primal_program
+
+
+def _random_spectrum(rng, n, lo, hi):
+    s = Spectrum.new_from_arrays(np.round(np.sort(rng.uniform(lo, hi, n)), 3), rng.uniform(0.1, 1., n))
+    s.normalize()
+    return s
+
+
+def _problem(seed, k=4):
+    rng = np.random.default_rng(seed)
+    query = [_random_spectrum(rng, 5, 100. + i, 103. + i) for i in range(k)]
+    # A mixture of the theoretical spectra, shifted, with noise in between
+    weights = rng.uniform(0.2, 1., k)
+    mz = np.concatenate([q.mz + rng.normal(0., 0.01, len(q.mz)) for q in query]
+                        + [rng.uniform(99., 108., 20)])
+    intensity = np.concatenate([w*q.intensity for w, q in zip(weights, query)]
+                               + [rng.uniform(0., 0.05, 20)])
+    spectrum = Spectrum.new_from_arrays(np.round(mz, 3), intensity)
+    spectrum.normalize()
+    return spectrum, query
+
+
+def _cost(spectrum, query, proportions, noise, penalty):
+    """The transport cost of explaining the spectrum with the given solution."""
+    mz = np.concatenate([spectrum.mz] + [q.mz for q in query])
+    signal = np.concatenate([spectrum.intensity - noise] + [-p*q.intensity for p, q in zip(proportions, query)])
+    order = np.argsort(mz, kind='stable')
+    return np.abs(np.cumsum(signal[order])[:-1]).dot(np.diff(mz[order])) + penalty*np.sum(noise)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_highs_backend_agrees_with_pulp(seed):
+    spectrum, query = _problem(seed)
+    expected = dualdeconv2(spectrum, query, 0.5)
+    result = dualdeconv2(spectrum, query, 0.5, backend='highs')
+    assert result['status'] == expected['status'] == 1
+    assert np.isclose(result['fun'], expected['fun'], rtol=1e-7)
+    assert len(result['trash']) == len(expected['trash'])
+    cost = _cost(spectrum, query, result['probs'], np.array(result['trash']), 0.5)
+    assert np.isclose(cost, expected['fun']/1e04, rtol=0., atol=1e-8)
+    # The same holds for the whole pipeline
+    expected = estimate_proportions(spectrum, query, MTD=0.5)
+    result = estimate_proportions(spectrum, query, MTD=0.5, backend='highs')
+    assert np.isclose(_cost(spectrum, query, result['proportions'], np.array(result['noise']), 0.5),
+                      _cost(spectrum, query, expected['proportions'], np.array(expected['noise']), 0.5),
+                      rtol=0., atol=1e-7)
+
+
+def test_unknown_backend():
+    spectrum, query = _problem(0)
+    with pytest.raises(ValueError):
+        dualdeconv2(spectrum, query, 0.5, backend='simplex')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_primal_program_agrees_with_pulp(seed):
+    # The primal form is used by dualdeconv2_approximate and Deconvolver
+    spectrum, query = _problem(seed)
+    expected = dualdeconv2(spectrum, query, 0.5)
+    mass_axis, exp_vec, thr_matrix = _sparse_problem(spectrum, query, 1e04)
+    result = _primal_program(mass_axis, exp_vec, thr_matrix, 0.5e04)
+    assert result.status == 0
+    assert np.isclose(result.fun, expected['fun'], rtol=1e-7)
+    k, n = len(query), len(mass_axis)
+    noise = result.x[k + 2*(n - 1):][exp_vec > 0.]
+    cost = _cost(spectrum, query, result.x[:k], noise, 0.5)
+    assert np.isclose(cost, expected['fun']/1e04, rtol=0., atol=1e-8)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_deconvolver_agrees_with_estimate_proportions(seed):
+    spectrum, query = _problem(seed)
+    optimum = dualdeconv2(spectrum, query, 0.5, backend='highs')['fun']/1e04
+    expected = estimate_proportions(spectrum, query, MTD=0.5)
+    expected = _cost(spectrum, query, expected['proportions'], np.array(expected['noise']), 0.5)
+    deconvolver = Deconvolver(query, 0.5, mass_axis=spectrum.mz)
+    for highs in (deconvolver._highs, None):
+        # Without highspy, the same program is solved by scipy.optimize.linprog
+        deconvolver._highs = highs
+        result = deconvolver.deconvolve(spectrum)
+        assert result['binning_error'] == 0.
+        assert np.isclose(sum(result['proportions']) + sum(result['noise']), 1.)
+        # The optimal proportions need not be unique, so the costs are compared;
+        # estimate_proportions may lose optimality when splitting the spectrum
+        cost = _cost(spectrum, query, result['proportions'], np.array(result['noise']), 0.5)
+        assert np.isclose(cost, optimum, rtol=0., atol=1e-8)
+        assert cost <= expected + 1e-8
+
+
+def test_binned_deconvolution_within_binning_error():
+    spectrum, query = _problem(0)
+    exact = dualdeconv2(spectrum, query, 0.5, backend='highs')
+    for warm_start in (False, True):
+        deconvolver = Deconvolver(query, 0.5, bin_width=0.05, warm_start=warm_start)
+        for _ in range(2):
+            result = deconvolver.deconvolve(spectrum)
+            cost = _cost(spectrum, query, result['proportions'], np.array(result['noise']), 0.5)
+            assert cost <= exact['fun']/1e04 + 2*result['binning_error'] + 1e-8
+
+
+def test_deconvolver_zero_intensity_peaks():
+    query = [Spectrum.new_from_arrays(np.array([100., 101.]), np.array([0.5, 0.5]))]
+    deconvolver = Deconvolver(query, 0.5, bin_width=0.1)
+    spectrum = Spectrum()
+    spectrum._set_arrays(np.array([99.5, 100., 100.9]), np.array([0., 1., 0.]))
+    result = deconvolver.deconvolve(spectrum)
+    assert len(result['noise']) == 3
+    assert result['noise'][0] == result['noise'][2] == 0.
+    assert np.isclose(sum(result['proportions']) + sum(result['noise']), 1.)
+
+
+def test_deconvolver_requires_mass_axis():
+    query = [Spectrum.new_from_arrays(np.array([100., 101.]), np.array([0.5, 0.5]))]
+    with pytest.raises(ValueError):
+        Deconvolver(query, 0.5)
+
+
+def _profile_problem(seed, k=4):
+    rng = np.random.default_rng(seed)
+    query = [_random_spectrum(rng, 5, 100. + i, 103. + i) for i in range(k)]
+    weights = rng.uniform(0.2, 1., k)
+    mz = np.round(np.arange(99.5, 107.5, 0.002), 6)
+    intensity = rng.uniform(0., 0.01, len(mz))
+    for w, q in zip(weights, query):
+        for m, i in q.confs:
+            intensity += w*i*np.exp(-(mz - m - 0.002)**2/(2*0.005**2))
+    spectrum = Spectrum.new_from_arrays(mz, intensity)
+    spectrum.normalize()
+    return spectrum, query
+
+
+@pytest.mark.parametrize('gap', [1e-2, 1e-3])
+def test_approximate_deconvolution_gap(gap):
+    spectrum, query = _profile_problem(0)
+    exact = dualdeconv2(spectrum, query, 0.5, backend='highs')['fun']/1e04
+    result = dualdeconv2_approximate(spectrum, query, 0.5, gap=gap)
+    assert 0. <= result['gap'] <= gap
+    # The reported value is an upper bound within the gap from the optimum
+    assert exact - 1e-8 <= result['fun']/1e04 <= exact + result['gap'] + 1e-8
+    assert np.isclose(_cost(spectrum, query, result['probs'], np.array(result['trash']), 0.5),
+                      result['fun']/1e04, rtol=0., atol=1e-8)
+    # In estimate_proportions, the gaps of chunks are weighted by their ion currents
+    result = estimate_proportions(spectrum, query, MTD=0.5, gap=gap)
+    assert 0. <= result['gap'] <= gap
+    cost = _cost(spectrum, query, result['proportions'], np.array(result['noise']), 0.5)
+    assert exact - 1e-8 <= cost <= exact + result['gap'] + 1e-8
+
+
+def test_parallel_deconvolution_agrees_with_serial():
+    from concurrent.futures import ThreadPoolExecutor
+    # Several well separated chunks
+    rng = np.random.default_rng(7)
+    query = [_random_spectrum(rng, 4, 100. + 10*i, 102. + 10*i) for i in range(6)]
+    spectrum = Spectrum.linear_combination(query, rng.uniform(0.2, 1., 6))
+    noise = Spectrum.new_from_arrays(np.round(rng.uniform(99., 160., 40), 3), rng.uniform(0., 0.01, 40))
+    spectrum = Spectrum.linear_combination([spectrum, noise], [1., 1.])
+    spectrum.normalize()
+    serial = estimate_proportions(spectrum, query, MTD=0.5, backend='highs')
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        threads = estimate_proportions(spectrum, query, MTD=0.5, backend='highs', executor=executor)
+    processes = estimate_proportions(spectrum, query, MTD=0.5, backend='highs', n_jobs=2)
+    for result in (threads, processes):
+        assert np.allclose(result['proportions'], serial['proportions'], rtol=0., atol=1e-12)
+        assert np.allclose(result['noise'], serial['noise'], rtol=0., atol=1e-12)
@@ -0,0 +1,97 @@
+import base64
+import gzip
+import zlib
+import numpy as np
+import pytest
+from masserstein import read_mzml
+
+
+def _binary_array(values, accession, dtype, compress):
+    data = np.asarray(values, dtype=dtype).tobytes()
+    if compress:
+        data = zlib.compress(data)
+    precision = ('MS:1000521', '32-bit float') if dtype == '<f4' else ('MS:1000523', '64-bit float')
+    compression = ('MS:1000574', 'zlib compression') if compress else ('MS:1000576', 'no compression')
+    return ('<binaryDataArray encodedLength="%i">'
+            '<cvParam cvRef="MS" accession="%s" name="%s"/>'
+            '<cvParam cvRef="MS" accession="%s" name="%s"/>'
+            '<cvParam cvRef="MS" accession="%s" name="array"/>'
+            '<binary>%s</binary></binaryDataArray>'
+            % (len(data), precision[0], precision[1], compression[0], compression[1],
+               accession, base64.b64encode(data).decode('ascii')))
+
+
+def _spectrum(index, level, time, unit, mz, intensity, dtype, compress):
+    units = {'second': 'UO:0000010', 'minute': 'UO:0000031'}
+    return ('<spectrum index="%i" id="scan=%i" defaultArrayLength="%i">'
+            '<cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="%i"/>'
+            '<scanList count="1"><scan>'
+            '<cvParam cvRef="MS" accession="MS:1000016" name="scan start time" value="%s" '
+            'unitCvRef="UO" unitAccession="%s" unitName="%s"/>'
+            '</scan></scanList>'
+            '<binaryDataArrayList count="2">%s%s</binaryDataArrayList></spectrum>'
+            % (index, index + 1, len(mz), level, time, units[unit], unit,
+               _binary_array(mz, 'MS:1000514', dtype, compress),
+               _binary_array(intensity, 'MS:1000515', dtype, compress)))
+
+
+# index, MS level, retention time and its unit, data type, compression
+_SCANS = [(0, 1, 30., 'second', '<f8', True),
+          (1, 2, 0.75, 'minute', '<f4', False),
+          (2, 1, 90., 'second', '<f4', True),
+          (3, 2, 2., 'minute', '<f8', False)]
+
+
+def _peaks(index):
+    mz = 100. + index + np.array([0., 0.5, 1.25])
+    intensity = np.array([1., 2., 4.]) * (index + 1)
+    return mz, intensity
+
+
+def _write_mzml(path, truncated=False):
+    spectra = [_spectrum(i, level, time, unit, *_peaks(i), dtype=dtype, compress=compress)
+               for i, level, time, unit, dtype, compress in _SCANS]
+    text = ('<?xml version="1.0" encoding="utf-8"?>'
+            '<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0"><run id="run">'
+            '<spectrumList count="%i">%s' % (len(spectra), ''.join(spectra)))
+    if truncated:
+        # A damaged tail after a spectrum past the scan range,
+        # reached only without the early break
+        text += _spectrum(4, 1, 3., 'minute', *_peaks(4), dtype='<f8', compress=False)
+        text += '<spectrum index="5" id="scan=6"><cvParam'
+    else:
+        text += '</spectrumList></run></mzML>'
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as h:
+        h.write(text)
+    return path
+
+
+@pytest.mark.parametrize('name', ['run.mzML', 'run.mzML.gz'])
+def test_read_all_spectra(tmp_path, name):
+    spectra = list(read_mzml(_write_mzml(str(tmp_path / name))))
+    assert [s.label for s in spectra] == ['scan=1', 'scan=2', 'scan=3', 'scan=4']
+    assert [s.ms_level for s in spectra] == [1, 2, 1, 2]
+    # Retention times in seconds are converted to minutes
+    assert np.allclose([s.retention_time for s in spectra], [0.5, 0.75, 1.5, 2.])
+    for i, s in enumerate(spectra):
+        mz, intensity = _peaks(i)
+        # 32-bit floats are exact for these values
+        assert np.array_equal(s.mz, mz)
+        assert np.array_equal(s.intensity, intensity)
+
+
+def test_filters(tmp_path):
+    path = _write_mzml(str(tmp_path / 'run.mzML'))
+    assert [s.label for s in read_mzml(path, ms_level=1)] == ['scan=1', 'scan=3']
+    assert [s.label for s in read_mzml(path, scan_range=(1, 2))] == ['scan=2', 'scan=3']
+    assert [s.label for s in read_mzml(path, rt_range=(0.6, 1.5))] == ['scan=2', 'scan=3']
+    assert [s.label for s in read_mzml(path, ms_level=2, rt_range=(0., 1.))] == ['scan=2']
+
+
+def test_scan_range_stops_reading(tmp_path):
+    path = _write_mzml(str(tmp_path / 'run.mzML'), truncated=True)
+    assert [s.label for s in read_mzml(path, scan_range=(0, 3))] == ['scan=1', 'scan=2', 'scan=3', 'scan=4']
+    assert [s.label for s in read_mzml(path, scan_range=(2, 2))] == ['scan=3']
+    with pytest.raises(SyntaxError):
+        list(read_mzml(path))
@@ -0,0 +1,66 @@
+import numpy as np
+from masserstein.peptides import (digest, digest_formulas, get_protein_composition,
+                                  modification_variants, modification_vectors)
+
+
+def test_trypsin_does_not_cleave_before_proline():
+    assert list(digest('AKPRGKAR')) == ['AKPR', 'GK', 'AR']
+    assert list(digest('AKPRGKAR', enzyme='trypsin/p')) == ['AK', 'PR', 'GK', 'AR']
+
+
+def test_missed_cleavages():
+    assert list(digest('AKPRGKAR', missed_cleavages=1)) == \
+        ['AKPR', 'AKPRGK', 'GK', 'GKAR', 'AR']
+    assert list(digest('AKPRGKAR', missed_cleavages=5)) == \
+        ['AKPR', 'AKPRGK', 'AKPRGKAR', 'GK', 'GKAR', 'AR']
+
+
+def test_length_bounds():
+    assert list(digest('AKPRGKAR', missed_cleavages=1, min_length=3)) == \
+        ['AKPR', 'AKPRGK', 'GKAR']
+    assert list(digest('AKPRGKAR', missed_cleavages=1, max_length=2)) == ['GK', 'AR']
+    assert list(digest('AKPRGKAR', missed_cleavages=1, min_length=3, max_length=4)) == \
+        ['AKPR', 'GKAR']
+
+
+def _variants(*args, **kwds):
+    return {tuple(sorted(mods.items())): composition
+            for composition, mods in modification_variants(*args, **kwds)}
+
+
+def test_two_modifications_of_one_residue_share_its_occurrences():
+    vectors = dict(modification_vectors)
+    variants = _variants('AQK', variable=['deaeQ', 'deapQ'])
+    assert set(variants) == {(), (('deaeQ', 1),), (('deapQ', 1),)}
+    variants = _variants('QAQK', variable=['deaeQ', 'deapQ'], max_modifications=3)
+    assert set(variants) == {(), (('deaeQ', 1),), (('deapQ', 1),), (('deaeQ', 2),),
+                             (('deaeQ', 1), ('deapQ', 1)), (('deapQ', 2),)}
+    base = get_protein_composition('QAQK')
+    assert np.array_equal(variants[(('deaeQ', 1), ('deapQ', 1))],
+                          base + vectors['deaeQ'] + vectors['deapQ'])
+    # max_modifications bounds the total number of modifications
+    variants = _variants('QAQK', variable=['deaeQ', 'deapQ'], max_modifications=1)
+    assert set(variants) == {(), (('deaeQ', 1),), (('deapQ', 1),)}
+
+
+def test_fixed_modification():
+    vectors = dict(modification_vectors)
+    base = get_protein_composition('ACMCK')
+    variants = _variants('ACMCK', variable=['carC', 'oxM'], fixed=['carC'])
+    # Carbamidomethylated cysteines cannot take variable modifications
+    assert set(variants) == {(), (('oxM', 1),)}
+    assert np.array_equal(variants[()], base + 2*vectors['carC'])
+    assert np.array_equal(variants[(('oxM', 1),)],
+                          base + 2*vectors['carC'] + vectors['oxM'])
+
+
+def test_digest_formulas_deduplicates_compositions():
+    # LK and IK have equal compositions, GK occurs in both sequences
+    results = list(digest_formulas(['LKGK', 'IKGKR']))
+    formulas = [formula for formula, _, _ in results]
+    assert len(formulas) == len(set(formulas))
+    assert [peptide for _, peptide, _ in results] == ['LK', 'GK', 'R']
+    results = list(digest_formulas(['MK', 'AQK'], variable=['oxM', 'deaeQ', 'deapQ']))
+    assert [(peptide, mods) for _, peptide, mods in results] == \
+        [('MK', {}), ('MK', {'oxM': 1}), ('AQK', {}),
+         ('AQK', {'deapQ': 1}), ('AQK', {'deaeQ': 1})]
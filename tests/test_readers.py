@@ -0,0 +1,60 @@
+import gzip
+import numpy as np
+import pytest
+from masserstein import read_peak_list
+
+
+def _peaks(n=200):
+    mz = np.round(np.linspace(100., 300., n), 4)
+    intensity = np.round(np.linspace(1., 50., n), 3)
+    return mz, intensity
+
+
+def _write(path, lines, compress=False):
+    text = '\n'.join(lines)
+    if compress:
+        with gzip.open(path, 'wt') as h:
+            h.write(text)
+    else:
+        with open(path, 'w') as h:
+            h.write(text)
+
+
+@pytest.mark.parametrize('delimiter', ['\t', ',', ' '])
+@pytest.mark.parametrize('chunk_size', [7, 64, 1 << 22])
+def test_chunked_reading_with_header_and_comments(tmp_path, delimiter, chunk_size):
+    mz, intensity = _peaks()
+    lines = ['# exported spectrum', 'mz%sintensity' % delimiter]
+    for i, (m, x) in enumerate(zip(mz, intensity)):
+        if i % 50 == 25:
+            lines.append('# comment inside the data')
+        if i % 70 == 35:
+            lines.append('')
+        lines.append('%s%s%s%s0' % (m, delimiter, x, delimiter))
+    path = str(tmp_path / 'peaks.txt')
+    _write(path, lines)
+    read_mz, read_intensity = read_peak_list(path, chunk_size=chunk_size)
+    assert np.array_equal(read_mz, mz)
+    assert np.array_equal(read_intensity, intensity)
+
+
+def test_gzipped_file_spanning_chunks(tmp_path):
+    mz, intensity = _peaks()
+    path = str(tmp_path / 'peaks.txt.gz')
+    _write(path, ['%s %s' % p for p in zip(mz, intensity)], compress=True)
+    read_mz, read_intensity = read_peak_list(path, chunk_size=32)
+    assert np.array_equal(read_mz, mz)
+    assert np.array_equal(read_intensity, intensity)
+
+
+def test_empty_and_malformed_files(tmp_path):
+    path = str(tmp_path / 'empty.txt')
+    _write(path, ['# nothing here', 'mz intensity'])
+    read_mz, read_intensity = read_peak_list(path)
+    assert len(read_mz) == len(read_intensity) == 0
+    _write(path, ['100.0', '101.0'])
+    with pytest.raises(ValueError):
+        read_peak_list(path)
+    _write(path, ['100.0 1.0', '101.0 2.0 3.0'])
+    with pytest.raises(ValueError):
+        read_peak_list(path)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from masserstein import Spectrum
+
+
+def test_filter_against_theoretical():
+    experimental = Spectrum(confs=[(99.5, 1.), (100.05, 2.), (150., 3.), (200.1, 4.), (250., 5.)])
+    theoreticals = [Spectrum(confs=[(100., 0.5), (101., 0.5)]),
+                    Spectrum(confs=[(200., 1.)])]
+    filtered = Spectrum.filter_against_theoretical(experimental, theoreticals, margin=0.15)
+    assert np.array_equal(filtered.mz, [100.05, 200.1])
+    assert np.array_equal(filtered.intensity, [2., 4.])
+    single = Spectrum.filter_against_theoretical(experimental, theoreticals[1], margin=0.15)
+    assert np.array_equal(single.mz, [200.1])
+    generator = Spectrum.filter_against_theoretical(experimental, iter(theoreticals), margin=0.15)
+    assert np.array_equal(generator.mz, filtered.mz)
+
+
+def test_penalized_wsdistance_matches_linear_program():
+    from scipy.optimize import linprog
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        p = Spectrum.new_from_arrays(np.sort(rng.uniform(0., 10., 8)), rng.uniform(0.1, 1., 8))
+        q = Spectrum.new_from_arrays(np.sort(rng.uniform(0., 10., 6)), rng.uniform(0.1, 1., 6))
+        p.normalize()
+        q.normalize()
+        penalty = rng.uniform(0.2, 3.)
+        distance, removed = p.WSDistance(q, penalty=penalty)
+        # Transport plan and removed intensities, removal costing penalty/2
+        n, m = len(p), len(q)
+        cost = np.concatenate((np.abs(p.mz[:, None] - q.mz[None, :]).ravel(),
+                               np.full(n + m, penalty/2.)))
+        A = np.zeros((n + m, n*m + n + m))
+        for i in range(n):
+            A[i, i*m:(i+1)*m] = 1.
+        for j in range(m):
+            A[n + j, j:n*m:m] = 1.
+        A[:, n*m:] = np.eye(n + m)
+        result = linprog(cost, A_eq=A, b_eq=np.concatenate((p.intensity, q.intensity)),
+                         bounds=(0., None), method='highs')
+        assert np.isclose(distance, result.fun, atol=1e-9)
+        # Normalized spectra lose equal intensities
+        assert np.isclose(removed, result.x[n*m:n*m+n].sum(), atol=1e-9)
+        assert np.isclose(removed, result.x[n*m+n:].sum(), atol=1e-9)
+
+
+def test_new_from_expression():
+    spectra = Spectrum.new_from_expression('CH3(CH2)[2,5-6]NH2 + H[0-1]Na[0-1]')
+    labels = [s.label for s in spectra]
+    assert len(labels) == 9
+    assert 'CH3(CH2)5NH2 + H1Na1' in labels
+    for spectrum in spectra:
+        expected = Spectrum(spectrum.formula, charge=spectrum.charge)
+        assert np.allclose(spectrum.mz, expected.mz)
+        assert np.allclose(spectrum.intensity, expected.intensity)
+    spectra = Spectrum.new_from_expression('C6H12O6 - H[1-2]')
+    assert [s.charge for s in spectra] == [-1, -2]
+    assert [s.formula for s in spectra] == ['C6H11O6', 'C6H10O6']
+
+
+@pytest.mark.parametrize('charges', [[1, 2, 3, 5], [-1, -2, -4], [-2, 1, 3]])
+def test_new_charge_states_matches_constructor(charges):
+    formula = 'C254H377N65O75S6'
+    spectra = Spectrum.new_charge_states(formula, charges)
+    assert len(spectra) == len(charges)
+    for charge, spectrum in zip(charges, spectra):
+        expected = Spectrum(formula, charge=charge, adduct='H')
+        assert len(spectrum.mz) == len(expected.mz)
+        assert np.allclose(spectrum.mz, expected.mz, rtol=0., atol=1e-13*expected.mz.max())
+        assert np.allclose(spectrum.intensity, expected.intensity, rtol=1e-9, atol=0.)
+
+
+def test_batch_from_formulas_accepts_numpy_charge():
+    formulas = ['C6H12O6', 'C2H5OH', 'C8H10N4O2']
+    expected = Spectrum.batch_from_formulas(formulas, charges=[2]*3)
+    for charges in [2, np.int64(2), np.array(2)]:
+        spectra = Spectrum.batch_from_formulas(formulas, charges=charges)
+        for spectrum, other in zip(spectra, expected):
+            assert spectrum.charge == 2
+            assert np.array_equal(spectrum.mz, other.mz)
+            assert np.array_equal(spectrum.intensity, other.intensity)